@@ -0,0 +1,91 @@
+"""Offline verification of license leases issued by the key server.
+
+This module has no dependency on the server package and can be shipped
+with client applications. It checks Ed25519 leases and needs the
+``cryptography`` package. Servers without it sign leases with HMAC, which
+clients cannot check offline; verify those online with
+``POST /verify-lease``.
+
+Example::
+
+    from lease_verifier import LeaseError, verify_lease
+
+    try:
+        lease = verify_lease(
+            token,
+            public_key=PUBLIC_KEY,  # from GET /lease-public-key
+            machine_id=my_machine_id,
+            revocations=cached_revocations,  # "revoked" from GET /lease-revocations
+        )
+    except LeaseError as e:
+        ...  # call POST /key?lease=true to renew, or refuse to start
+"""
+
+import base64
+import hashlib
+import json
+import time
+
+LEASE_VERSION = 1
+
+
+class LeaseError(Exception):
+    """A lease failed verification. ``status`` is ``invalid``, ``expired`` or ``revoked``."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def key_fingerprint(key):
+    """Return the fingerprint used for ``key`` in the revocation list."""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def verify_lease(token, public_key, machine_id=None, revocations=(), now=None):
+    """Verify ``token`` and return its payload.
+
+    ``public_key`` is the base64 Ed25519 public key of the server.
+    ``revocations`` is the ``revoked`` list from ``GET /lease-revocations``.
+    Raises :class:`LeaseError` on failure.
+    """
+    try:
+        body, signature = token.split(".")
+        signature = _b64decode(signature)
+        payload = json.loads(_b64decode(body))
+    except (AttributeError, ValueError):
+        raise LeaseError("invalid", "The lease is malformed.")
+
+    algorithm = payload.get("alg")
+    if algorithm != "EdDSA":
+        raise LeaseError("invalid", f"{algorithm} leases can only be verified online.")
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+    verifier = Ed25519PublicKey.from_public_bytes(base64.b64decode(public_key))
+    try:
+        verifier.verify(signature, body.encode())
+    except InvalidSignature:
+        raise LeaseError("invalid", "The lease signature is invalid.")
+
+    if payload.get("v") != LEASE_VERSION:
+        raise LeaseError("invalid", "Unsupported lease version.")
+    if machine_id is not None and payload["mid"] != machine_id:
+        raise LeaseError("invalid", "The lease belongs to another machine.")
+    if payload["exp"] <= (now if now is not None else time.time()):
+        raise LeaseError("expired", "The lease has expired.")
+
+    fingerprint = key_fingerprint(payload["key"])
+    for item in revocations:
+        if (
+            item["fp"] == fingerprint
+            and item["mid"] in (None, payload["mid"])
+            and item["at"] >= payload["iat"]
+        ):
+            raise LeaseError("revoked", "The lease has been revoked.")
+
+    return payload
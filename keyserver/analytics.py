@@ -0,0 +1,147 @@
+import os
+from collections import Counter, deque
+from threading import Condition, Event, Lock
+
+# Dimensions request log entries can be grouped by
+DIMENSIONS = ("action", "product_id", "username", "ip_address")
+
+# Number of recent log entries kept in memory for /recent-logs
+RECENT_LOGS_SIZE = int(os.getenv("RECENT_LOGS_SIZE", 10000))
+
+# Time buckets, as the length of the ISO timestamp prefix they keep
+BUCKETS = {"hour": 13, "day": 10, "month": 7}
+
+
+def _row(entry):
+    """Return the rollup row (hour, *DIMENSIONS) for a log entry."""
+    client = entry.get("client") or {}
+    details = entry.get("details") or {}
+    return (
+        (entry.get("timestamp") or "")[: BUCKETS["hour"]],
+        entry.get("action"),
+        details.get("product_id"),
+        client.get("username"),
+        client.get("ip_address"),
+    )
+
+
+class LogRollups:
+    """Request log counts, maintained as entries are written.
+
+    Entries are counted per hour and per distinct combination of
+    ``DIMENSIONS``. Queries sum over these rows, so their cost depends on
+    the number of distinct combinations rather than the size of the log.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.ready = Event()
+        self._counts = Counter()
+
+    def load(self, entries):
+        """Rebuild the rollups from existing log entries."""
+        counts = Counter(_row(entry) for entry in entries)
+        with self.lock:
+            self._counts = counts
+        self.ready.set()
+
+    def add(self, entry):
+        with self.lock:
+            self._counts[_row(entry)] += 1
+
+    def query(self, group_by=(), bucket=None, since=None, until=None, filters=None):
+        """Return counts grouped by ``group_by`` and an optional time bucket.
+
+        ``since`` and ``until`` are inclusive ISO date or timestamp prefixes.
+        ``filters`` maps dimensions to the single value they must have.
+        """
+        positions = [DIMENSIONS.index(name) + 1 for name in group_by]
+        filters = [
+            (DIMENSIONS.index(name) + 1, value)
+            for name, value in (filters or {}).items()
+        ]
+        width = BUCKETS[bucket] if bucket else None
+
+        with self.lock:
+            rows = list(self._counts.items())
+
+        grouped = Counter()
+        for row, count in rows:
+            hour = row[0]
+            if since and hour < since[: BUCKETS["hour"]]:
+                continue
+            if until and hour[: len(until)] > until:
+                continue
+            if any(row[position] != value for position, value in filters):
+                continue
+            group = tuple(row[position] for position in positions)
+            if width:
+                group = (hour[:width],) + group
+            grouped[group] += count
+
+        names = (("bucket",) if width else ()) + tuple(group_by)
+        results = [
+            dict(zip(names, group), count=count) for group, count in grouped.items()
+        ]
+        # Chronological when bucketed, busiest first within each bucket
+        results.sort(key=lambda result: (result.get("bucket", ""), -result["count"]))
+        return results
+
+
+class RecentLogs:
+    """The most recent request log entries, kept in memory for tailing.
+
+    Entries are numbered as they are added so readers can ask for the ones
+    after the last entry they saw.
+    """
+
+    def __init__(self, size=RECENT_LOGS_SIZE):
+        self.size = size
+        self.seq = 0
+        self._entries = deque(maxlen=size)
+        self._added = Condition()
+
+    def record(self, entries):
+        """Replace the kept entries with the last of ``entries``, yielding each."""
+        with self._added:
+            self._entries.clear()
+        for entry in entries:
+            self.add(entry)
+            yield entry
+
+    def add(self, entry):
+        with self._added:
+            self.seq += 1
+            self._entries.append((self.seq, entry))
+            self._added.notify_all()
+
+    def query(self, since=None, limit=100, filters=None, wait=0, before=None):
+        """Return ``(seq, entries)`` with the last ``limit`` matching entries.
+
+        Only entries after ``since`` are returned when it is given, waiting
+        up to ``wait`` seconds for one to arrive, and only entries before
+        ``before`` when that is given, to page back. ``filters`` maps
+        dimensions to the single value they must have. ``seq`` is the
+        number to pass as ``since`` next time.
+        """
+        filters = [
+            (DIMENSIONS.index(name) + 1, value)
+            for name, value in (filters or {}).items()
+        ]
+        with self._added:
+            if since is not None:
+                since = min(since, self.seq)  # Numbering restarts with the server
+                if wait:
+                    self._added.wait_for(lambda: self.seq > since, timeout=wait)
+            results = []
+            for seq, entry in reversed(self._entries):
+                if (since is not None and seq <= since) or len(results) >= limit:
+                    break
+                if before is not None and seq >= before:
+                    continue
+                row = _row(entry)
+                if all(row[position] == value for position, value in filters):
+                    results.append(dict(entry, seq=seq))
+            seq = self.seq
+        results.reverse()
+        return seq, results
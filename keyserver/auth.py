@@ -54,3 +54,28 @@ def check_auth():
         return None
 
     return USERS[auth.username]
+
+
+def load_server_secret(env_var, filename, size=32):
+    """Return a server-side secret key as bytes.
+
+    The key comes from ``env_var`` (hex encoded) when set. Otherwise a random
+    key is generated on first use and kept in ``key_storage/<filename>``, so
+    it never falls back to a default shipped in ``credentials.env``.
+    """
+    value = os.getenv(env_var)
+    if value:
+        return bytes.fromhex(value)
+
+    path = os.path.join(os.path.dirname(__file__), "key_storage", filename)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    secret = os.urandom(size)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    return secret
@@ -0,0 +1,171 @@
+"""JSON encoding for the keys files, the request log and API responses.
+
+Everything the server writes as JSON goes through :func:`dumps` and
+everything it reads through :func:`loads`. They use orjson when it is
+installed (``pip install orjson``) and the standard library otherwise; set
+``JSON_CODEC=json`` to force the standard library.
+
+Output is compact by default. Set ``JSON_INDENT`` to a number of spaces to
+write indented keys files, array logs and responses instead; orjson only
+indents by 2, so other widths are written with the standard library.
+
+Compare the encoders on this machine with::
+
+    python -m keyserver.codec benchmark [keys]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import orjson
+except ImportError:  # Optional dependency
+    orjson = None
+
+
+class StdlibCodec:
+    name = "json"
+
+    def dumps(self, obj, indent=0, default=None):
+        if indent:
+            text = json.dumps(obj, indent=indent, ensure_ascii=False, default=default)
+        else:
+            text = json.dumps(
+                obj, separators=(",", ":"), ensure_ascii=False, default=default
+            )
+        return text.encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(StdlibCodec):
+    name = "orjson"
+
+    def dumps(self, obj, indent=0, default=None):
+        if indent not in (0, 2):
+            return super().dumps(obj, indent, default)
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+CODECS = {"json": StdlibCodec}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec
+
+JSON_CODEC = os.getenv("JSON_CODEC", "orjson" if orjson is not None else "json")
+JSON_INDENT = int(os.getenv("JSON_INDENT", 0))
+
+if JSON_CODEC not in CODECS:
+    raise RuntimeError(
+        f"JSON_CODEC={JSON_CODEC} is not available, use one of {', '.join(CODECS)}"
+    )
+backend = CODECS[JSON_CODEC]()
+
+
+def dumps(obj, indent=None, default=None):
+    """Encode ``obj`` to UTF-8 JSON bytes, indented by ``JSON_INDENT`` by default."""
+    return backend.dumps(obj, JSON_INDENT if indent is None else indent, default)
+
+
+def loads(data):
+    """Decode JSON from ``bytes`` or ``str``."""
+    return backend.loads(data)
+
+
+def _time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(count=100000, log_entries=2000, repeat=3):
+    """Time each JSON path with every available codec and print the results."""
+    from . import codec as module  # The copy the server uses, also under -m
+    from .server import app
+    from .store import Shard
+    from .streaming import append_log_entry
+
+    keys = [
+        {
+            "key": f"BENCH-{i:08d}",
+            "expiration_days": 30,
+            "expiration_date": "2030-01-01T00:00:00",
+            "machine_limit": 3,
+            "machine_ids": [f"machine-{i}"],
+            "product_id": "Bench",
+            "activated": True,
+        }
+        for i in range(count)
+    ]
+    log_entry = {
+        "timestamp": "2030-01-01T00:00:00",
+        "level": "INFO",
+        "client": {"ip_address": "127.0.0.1", "username": None},
+        "action": "validate_key",
+        "details": {"key": keys[0]["key"], "product_id": "Bench", "machine_id": "m"},
+    }
+    page = {"status": "success", "keys": keys[:1000], "next_cursor": 1000}
+
+    selected = module.backend
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        keys_path = os.path.join(tmp_dir, "keys.json")
+        logs_path = os.path.join(tmp_dir, "logs.json")
+
+        def save():
+            shard = Shard(keys_path)
+            shard.keys = keys
+            shard.persist()
+
+        def load():
+            Shard(keys_path).load()
+
+        def log():
+            with open(logs_path, "wb") as f:
+                f.write(b"[]")
+            for _ in range(log_entries):
+                append_log_entry(logs_path, log_entry)
+
+        def respond():
+            with app.app_context():
+                for _ in range(100):
+                    app.json.response(page).get_data()
+
+        paths = [
+            (f"save {count} keys", save),
+            (f"load {count} keys", load),
+            (f"append {log_entries} log entries", log),
+            ("100 responses of 1000 keys", respond),
+        ]
+        print(f"JSON_INDENT={JSON_INDENT}")
+        try:
+            for name, cls in CODECS.items():
+                module.backend = cls()
+                for label, func in paths:
+                    print(f"{name:>7}  {label}: {_time(func, repeat) * 1000:.1f} ms")
+        finally:
+            module.backend = selected
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if (
+        not args
+        or args[0] != "benchmark"
+        or len(args) > 2
+        or not (args[1:] == [] or args[1].isdigit())
+    ):
+        sys.exit("usage: python -m keyserver.codec benchmark [keys]")
+    benchmark(*(int(arg) for arg in args[1:]))
@@ -0,0 +1,226 @@
+"""Efficient downloads of the keys file and the request log.
+
+Exports carry an ETag and Last-Modified header derived from the file's
+size and modification time, so unchanged files are answered with 304, and
+byte ranges are honoured so clients can fetch only the appended tail of
+the log.
+
+Clients that accept ``zstd`` (when the optional ``zstandard`` package is
+installed) or ``gzip`` get a precompressed copy. Copies are cached in
+``export_cache/`` and rebuilt on the first request after the source file
+changes. Range requests are always served uncompressed so offsets refer
+to the file itself.
+"""
+
+import gzip
+import io
+import os
+import shutil
+import zlib
+from datetime import datetime, timezone
+from threading import Lock
+from flask import current_app, request, send_file
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+from .store import write_json_atomic
+from .streaming import stable_view
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "export_cache")
+
+_cache_lock = Lock()
+
+
+class FileView(io.RawIOBase):
+    """Read-only view of the first ``length`` bytes of ``f`` plus ``suffix``.
+
+    Used to serve a consistent copy of a file that is appended to in place
+    while the response is being streamed.
+    """
+
+    def __init__(self, f, length, suffix=b""):
+        super().__init__()
+        self._file = f
+        self._length = length
+        self._suffix = suffix
+        self._pos = 0
+        self.size = length + len(suffix)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}
+        self._pos = max(0, base[whence] + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)
+        if self._pos < self._length:
+            self._file.seek(self._pos)
+            count = self._file.readinto(view[: self._length - self._pos])
+        else:
+            start = self._pos - self._length
+            chunk = self._suffix[start : start + len(view)]
+            count = len(chunk)
+            view[:count] = chunk
+        self._pos += count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _negotiate_encoding():
+    if "Range" in request.headers:
+        return None
+    accepted = request.accept_encodings
+    if zstandard is not None and accepted["zstd"]:
+        return "zstd"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compress(source, target, encoding):
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as dst:
+        if encoding == "zstd":
+            zstandard.ZstdCompressor().copy_stream(source, dst)
+        else:
+            with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=6) as gz:
+                shutil.copyfileobj(source, gz)
+    os.replace(tmp_path, target)
+
+
+def compressed_variant(path, encoding, version, source):
+    """Return the cached ``encoding`` copy of ``path`` at ``version``.
+
+    ``source`` is a readable view of that version, only read on a cache miss.
+    """
+    name = f"{os.path.basename(path)}.{version}.{encoding}"
+    target = os.path.join(CACHE_DIR, name)
+    with _cache_lock:
+        if not os.path.exists(target):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Drop copies of older versions of this file
+            prefix = os.path.basename(path) + "."
+            for old in os.listdir(CACHE_DIR):
+                if old.startswith(prefix) and old.endswith("." + encoding):
+                    os.remove(os.path.join(CACHE_DIR, old))
+            _compress(source, target, encoding)
+    return target
+
+
+def keys_export_path(store):
+    """Return a single keys file for ``store``.
+
+    An unsharded store is exported as is. The shards of a sharded store are
+    combined into one file in the export cache, rebuilt when any changes.
+    """
+    if len(store.shards) == 1:
+        return store.path
+    with store.lock:
+        store.refresh()
+        digest = zlib.crc32(repr([shard.stamp for shard in store.shards]).encode())
+        name = f"{os.path.basename(store.path)}.combined-{digest:08x}"
+        target = os.path.join(CACHE_DIR, name)
+        if not os.path.exists(target):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            prefix = f"{os.path.basename(store.path)}.combined-"
+            for old in os.listdir(CACHE_DIR):
+                if old.startswith(prefix):
+                    os.remove(os.path.join(CACHE_DIR, old))
+            write_json_atomic(target, {"valid_keys": store.all()})
+    return target
+
+
+def _open_view(path, append_lock):
+    """Return a :class:`FileView` of the current version of ``path`` and its stat."""
+    f = open(path, "rb")  # Pins the current file even if it is replaced
+    if append_lock is not None:
+        with append_lock:
+            st = os.fstat(f.fileno())
+            return FileView(f, *stable_view(f)), st
+    st = os.fstat(f.fileno())
+    return FileView(f, st.st_size), st
+
+
+def send_export(path, append_lock=None, download_name=None, on_send=None):
+    """Send ``path`` as a conditional, range-capable, compressed download.
+
+    Files that are appended to in place (the request log) pass the lock
+    their writers hold, and are served as a consistent view taken under it.
+    Conditional requests for the current version get a 304 before anything
+    is compressed. Otherwise ``on_send`` is called first, and the view is
+    taken after it, so a download includes the log entry it writes.
+    """
+    download_name = download_name or os.path.basename(path)
+    encoding = _negotiate_encoding()
+
+    def version_of(view, st):
+        version = f"{view.size}-{st.st_mtime_ns}"
+        last_modified = datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+        return version, last_modified
+
+    view, st = _open_view(path, append_lock)
+    version, last_modified = version_of(view, st)
+    etag = f"{version}-{encoding}" if encoding is not None else version
+    if not is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified
+    ):
+        view.close()
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    if on_send is not None:
+        on_send()
+        view.close()
+        view, st = _open_view(path, append_lock)
+        version, last_modified = version_of(view, st)
+
+    if encoding is not None:
+        try:
+            variant = compressed_variant(path, encoding, version, view)
+        finally:
+            view.close()
+        response = send_file(
+            variant,
+            mimetype="application/json",
+            as_attachment=True,
+            download_name=download_name,
+            etag=f"{version}-{encoding}",
+            last_modified=last_modified,
+        )
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = current_app.response_class(
+            wrap_file(request.environ, view),
+            mimetype="application/json",
+            direct_passthrough=True,
+        )
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=download_name
+        )
+        response.content_length = view.size
+        response.last_modified = last_modified
+        response.set_etag(version)
+        response = response.make_conditional(
+            request.environ, accept_ranges=True, complete_length=view.size
+        )
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
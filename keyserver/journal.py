@@ -0,0 +1,70 @@
+import os
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from threading import Condition
+from .store import StoreListener
+
+# Number of recent changes kept for followers to catch up from
+JOURNAL_SIZE = int(os.getenv("JOURNAL_SIZE", 100000))
+
+
+def copy_entry(entry):
+    """Return a copy of ``entry`` that later in-place edits do not affect."""
+    return {**entry, "machine_ids": list(entry["machine_ids"])}
+
+
+class ChangeJournal(StoreListener):
+    """Numbered log of recent key store changes.
+
+    Every change gets the next sequence number. Followers remember the last
+    number they applied and ask for what came after it; when that is no
+    longer available (the journal wrapped, the store was reloaded or the
+    server restarted, which changes the ``epoch``) they must start again
+    from a snapshot.
+    """
+
+    def __init__(self, size=JOURNAL_SIZE):
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self._reset_seq = 0
+        self._records = deque(maxlen=size)
+        self._changed = Condition()
+
+    def reset(self, entries):
+        with self._changed:
+            self.seq += 1
+            self._reset_seq = self.seq
+            self._records.clear()
+            self._changed.notify_all()
+
+    def on_change(self, event, entry):
+        with self._changed:
+            self.seq += 1
+            self._records.append(
+                {
+                    "seq": self.seq,
+                    "event": event,
+                    "time": time.time(),
+                    "entry": copy_entry(entry),
+                }
+            )
+            self._changed.notify_all()
+
+    def changes_since(self, seq, epoch=None, limit=1000, wait=0):
+        """Return up to ``limit`` changes after ``seq``, or ``None`` to resync.
+
+        Waits up to ``wait`` seconds for a change when there is none yet.
+        """
+        with self._changed:
+            if wait and epoch in (None, self.epoch) and seq == self.seq:
+                self._changed.wait_for(lambda: self.seq != seq, timeout=wait)
+            if epoch not in (None, self.epoch) or seq > self.seq:
+                return None
+            if seq < self._reset_seq:
+                return None
+            if self._records and seq < self._records[0]["seq"] - 1:
+                return None  # Older changes were dropped from the journal
+            skip = len(self._records) - (self.seq - seq)
+            return list(islice(self._records, skip, skip + limit))
@@ -0,0 +1,197 @@
+"""Signed offline license leases.
+
+A lease is a compact token ``<payload>.<signature>`` (both base64url)
+returned by ``POST /key?lease=true``. The payload carries the key, machine
+ID, product ID and an expiry, so clients can verify it locally with
+``client/lease_verifier.py`` and only call back to renew it.
+
+Leases are signed with Ed25519 (``EdDSA``) when the optional
+``cryptography`` package is installed, so clients only need the public key
+from ``GET /lease-public-key``. Without it, or with ``LEASE_ALGORITHM=HS256``,
+they are signed with HMAC-SHA256; verifying those needs the server secret,
+so clients have to check them online with ``POST /verify-lease``.
+Revocation relies on short lease lifetimes plus the list served by
+``GET /lease-revocations``.
+"""
+
+import base64
+import hashlib
+import hmac
+import importlib.util
+import json
+import os
+import time
+from datetime import datetime
+from threading import Lock
+from .auth import load_server_secret
+from .store import write_json_atomic
+
+LEASE_VERSION = 1
+LEASE_TTL = int(os.getenv("LEASE_TTL_SECONDS", 24 * 60 * 60))
+LEASE_ALGORITHM = os.getenv(
+    "LEASE_ALGORITHM",
+    "EdDSA" if importlib.util.find_spec("cryptography") else "HS256",
+)
+# Environment variable holding the signing key of each algorithm
+LEASE_KEY_ENV = {"HS256": "LEASE_SECRET_KEY", "EdDSA": "LEASE_SIGNING_KEY"}
+
+
+class LeaseError(Exception):
+    """A lease failed verification. ``status`` is the API status to report."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def key_fingerprint(key):
+    """Identify a key in the public revocation list without disclosing it."""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class LeaseSigner:
+    def __init__(self, algorithm=LEASE_ALGORITHM, ttl=LEASE_TTL):
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.public_key = None
+        if algorithm == "HS256":
+            self._secret = load_server_secret(LEASE_KEY_ENV["HS256"], "lease_hmac.key")
+        elif algorithm == "EdDSA":
+            try:
+                from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+                    Ed25519PrivateKey,
+                )
+                from cryptography.hazmat.primitives.serialization import (
+                    Encoding,
+                    PublicFormat,
+                )
+            except ImportError:
+                raise RuntimeError(
+                    "LEASE_ALGORITHM=EdDSA requires the 'cryptography' package"
+                )
+            seed = load_server_secret(LEASE_KEY_ENV["EdDSA"], "lease_ed25519.key")
+            self._private_key = Ed25519PrivateKey.from_private_bytes(seed)
+            self._public_key = self._private_key.public_key()
+            self.public_key = self._public_key.public_bytes(
+                Encoding.Raw, PublicFormat.Raw
+            )
+        else:
+            raise ValueError(f"Unsupported lease algorithm: {algorithm}")
+
+    def _sign(self, data):
+        if self.algorithm == "HS256":
+            return hmac.new(self._secret, data, hashlib.sha256).digest()
+        return self._private_key.sign(data)
+
+    def _verify(self, data, signature):
+        if self.algorithm == "HS256":
+            return hmac.compare_digest(self._sign(data), signature)
+        from cryptography.exceptions import InvalidSignature
+
+        try:
+            self._public_key.verify(signature, data)
+        except InvalidSignature:
+            return False
+        return True
+
+    def issue(self, entry, machine_id, now=None):
+        """Return ``(token, expires_at)`` for ``machine_id`` on ``entry``."""
+        # Millisecond precision so a revocation and a re-issue within the
+        # same second are still ordered
+        now = round(now if now is not None else time.time(), 3)
+        expires_at = int(now) + self.ttl
+        if entry["expiration_date"]:
+            # Never outlive the key itself
+            key_expiry = datetime.fromisoformat(entry["expiration_date"])
+            expires_at = min(expires_at, int(key_expiry.timestamp()))
+        payload = {
+            "v": LEASE_VERSION,
+            "alg": self.algorithm,
+            "key": entry["key"],
+            "mid": machine_id,
+            "pid": entry["product_id"],
+            "iat": now,
+            "exp": expires_at,
+        }
+        body = b64encode(json.dumps(payload, separators=(",", ":")).encode())
+        return f"{body}.{b64encode(self._sign(body.encode()))}", expires_at
+
+    def decode(self, token, now=None):
+        """Return the payload of a valid lease or raise :class:`LeaseError`."""
+        try:
+            body, signature = token.split(".")
+            signature = b64decode(signature)
+        except (AttributeError, ValueError):
+            raise LeaseError("invalid", "The lease is malformed.")
+        if not self._verify(body.encode(), signature):
+            raise LeaseError("invalid", "The lease signature is invalid.")
+        payload = json.loads(b64decode(body))
+        if payload.get("v") != LEASE_VERSION:
+            raise LeaseError("invalid", "Unsupported lease version.")
+        if payload["exp"] <= (now if now is not None else time.time()):
+            raise LeaseError("expired", "The lease has expired.")
+        return payload
+
+
+class RevocationList:
+    """Keys and seats revoked within the last lease lifetime.
+
+    Older revocations are dropped: every lease issued before them has
+    expired by then, so the list stays small.
+    """
+
+    def __init__(self, path, ttl=LEASE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = Lock()
+        self._revoked = []
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self._revoked = json.load(f)
+
+    def revoke(self, key, machine_id=None):
+        """Revoke leases for ``key``, or only for ``machine_id`` on it."""
+        self.revoke_many([(key, machine_id)])
+
+    def revoke_many(self, seats, at=None):
+        """Revoke leases for every ``(key, machine_id)`` in ``seats`` at once.
+
+        ``at`` is when they were revoked (default now); leases issued up to
+        then are revoked. The list is written once for all of them.
+        """
+        at = round(at if at is not None else time.time(), 3)
+        with self.lock:
+            self._prune()
+            self._revoked.extend(
+                {"fp": key_fingerprint(key), "mid": machine_id, "at": at}
+                for key, machine_id in seats
+            )
+            write_json_atomic(self.path, self._revoked)
+
+    def is_revoked(self, payload):
+        fingerprint = key_fingerprint(payload["key"])
+        with self.lock:
+            return any(
+                item["fp"] == fingerprint
+                and item["mid"] in (None, payload["mid"])
+                and item["at"] >= payload["iat"]
+                for item in self._revoked
+            )
+
+    def snapshot(self):
+        with self.lock:
+            self._prune()
+            return list(self._revoked)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        self._revoked = [item for item in self._revoked if item["at"] >= cutoff]
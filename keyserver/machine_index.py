@@ -0,0 +1,48 @@
+from threading import Lock
+from .store import StoreListener
+
+
+class MachineIndex(StoreListener):
+    """Reverse index from machine ID to the keys activated on it.
+
+    Kept up to date from key store changes, so every code path that adds
+    or removes ``entry["machine_ids"]`` updates it through the store.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self._keys_by_machine = {}
+        # Machine IDs last seen on each key, to diff in-place updates
+        self._machines_by_key = {}
+
+    def reset(self, entries):
+        with self.lock:
+            self._keys_by_machine = {}
+            self._machines_by_key = {}
+            for entry in entries:
+                self._set(entry["key"], entry["machine_ids"])
+
+    def on_change(self, event, entry):
+        with self.lock:
+            if event in ("remove", "expire"):
+                self._set(entry["key"], ())
+            else:
+                self._set(entry["key"], entry["machine_ids"])
+
+    def _set(self, key, machine_ids):
+        old = self._machines_by_key.pop(key, frozenset())
+        new = frozenset(machine_ids)
+        for machine_id in old - new:
+            keys = self._keys_by_machine[machine_id]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_machine[machine_id]
+        for machine_id in new - old:
+            self._keys_by_machine.setdefault(machine_id, set()).add(key)
+        if new:
+            self._machines_by_key[key] = new
+
+    def keys_for(self, machine_id):
+        """Return the keys ``machine_id`` is activated on."""
+        with self.lock:
+            return sorted(self._keys_by_machine.get(machine_id, ()))
@@ -0,0 +1,331 @@
+"""Read replicas of the key store.
+
+Start a server with ``KEYSERVER_PRIMARY_URL`` set (for example
+``http://127.0.0.1:5000``) to run it as a replica of that primary. The
+replica loads a snapshot from ``GET /replication/snapshot`` and then
+follows ``GET /replication/changes`` with long polls, keeping an in-memory
+copy of the keys.
+
+A replica answers ``POST /key`` itself when the key is already activated
+on the machine and has not expired. Every other request, including
+activations and the other admin endpoints, is forwarded to the primary
+unchanged and its response relayed in chunks. Event streams and long polls
+(``wait`` above 0) are redirected to the primary instead, so they do not
+hold a replica thread. Removals reach a replica after the replication lag,
+which ``GET /replication/status`` reports.
+
+Leases are only signed by a replica when the lease key is shared through
+the environment (``LEASE_SIGNING_KEY`` or ``LEASE_SECRET_KEY``, matching
+``LEASE_ALGORITHM``) with the same value as on the primary. Otherwise each
+host would sign with its own generated key and clients could not verify
+the lease, so ``lease=true`` requests are forwarded to the primary.
+
+Replicas authenticate to the primary as ``REPLICATION_USERNAME`` (``admin``
+by default). A replica refuses to start without ``KEYSERVER_LOGS_FILE``, so
+it never writes to the primary's log file on a shared machine. Validations
+a replica answers are logged only there, and a replica serves the request
+log endpoints (``/log-stats``, ``/recent-logs`` and its stream, and
+``/request-logs``) from its own log. The primary's log endpoints count only
+the requests the primary handled, so add up the replicas' for the total.
+"""
+
+import base64
+import http.client
+import os
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+from flask import Response, jsonify, redirect, request
+from .auth import USERS
+from .codec import loads
+from .journal import copy_entry
+from .leases import LEASE_ALGORITHM, LEASE_KEY_ENV
+from .utils import issue_lease, log_request
+
+PRIMARY_URL = os.getenv("KEYSERVER_PRIMARY_URL")
+REPLICATION_USERNAME = os.getenv("REPLICATION_USERNAME", "admin")
+REPLICATION_PASSWORD = os.getenv(
+    "REPLICATION_PASSWORD", USERS.get(REPLICATION_USERNAME, {}).get("password")
+)
+# How long the primary holds a change poll open when nothing changes
+POLL_WAIT = 20
+RETRY_DELAY = 1
+# Size of the pieces forwarded responses are relayed in
+RELAY_CHUNK_SIZE = 64 * 1024
+# Without a key shared with the primary, replica-signed leases do not verify
+SHARED_LEASE_KEY = bool(os.getenv(LEASE_KEY_ENV.get(LEASE_ALGORITHM, "")))
+
+# Request headers passed on to the primary, and response headers passed back
+FORWARDED_REQUEST_HEADERS = (
+    "Authorization",
+    "Content-Type",
+    "X-Webhook-Signature",
+    "Accept-Encoding",
+    "Range",
+    "If-None-Match",
+    "If-Modified-Since",
+)
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding"}
+
+
+class PrimaryClient:
+    """HTTP client for the primary with one keep-alive connection per thread."""
+
+    def __init__(self, base_url, timeout=POLL_WAIT + 10):
+        url = urllib.parse.urlsplit(base_url)
+        self.https = url.scheme == "https"
+        self.host = url.netloc
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            cls = (
+                http.client.HTTPSConnection
+                if self.https
+                else http.client.HTTPConnection
+            )
+            connection = cls(self.host, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def request(self, method, path, body=None, headers=None, stream=False):
+        """Return ``(status, headers, body)`` of a request to the primary.
+
+        With ``stream`` the body is an iterator of chunks, which has to be
+        consumed before this thread makes another request.
+        """
+        for attempt in (1, 2):
+            connection = self._connection()
+            try:
+                connection.request(method, self.prefix + path, body, headers or {})
+                response = connection.getresponse()
+                if stream:
+                    body = self._relay(connection, response)
+                    return response.status, response.getheaders(), body
+                return response.status, response.getheaders(), response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # A kept-alive connection may have been closed by the primary
+                self._drop(connection)
+                if attempt == 2:
+                    raise
+
+    def _relay(self, connection, response):
+        try:
+            while chunk := response.read(RELAY_CHUNK_SIZE):
+                yield chunk
+        except BaseException:
+            # Cut short: the rest of the body is still on the connection
+            self._drop(connection)
+            raise
+
+    def _drop(self, connection):
+        connection.close()
+        if getattr(self._local, "connection", None) is connection:
+            self._local.connection = None
+
+    def get_json(self, path):
+        token = base64.b64encode(
+            f"{REPLICATION_USERNAME}:{REPLICATION_PASSWORD}".encode()
+        ).decode()
+        status, _, body = self.request(
+            "GET", path, headers={"Authorization": f"Basic {token}"}
+        )
+        return status, loads(body)
+
+
+class Replica:
+    """Follows the primary's key store and serves activated validations."""
+
+    def __init__(self, primary_url):
+        self.primary_url = primary_url
+        self.client = PrimaryClient(primary_url)
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self._keys = {}
+        self.epoch = None
+        self.seq = None
+        self.primary_seq = None
+        self.last_contact = None
+        self.last_apply_delay = None
+        self.last_error = None
+        self.resyncs = 0
+
+    def start(self):
+        threading.Thread(target=self.run, name="replica-follower", daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                if self.seq is None:
+                    self.resync()
+                else:
+                    self.poll()
+                self.last_error = None
+            except (OSError, ValueError, KeyError, http.client.HTTPException) as e:
+                self.last_error = str(e)
+                time.sleep(RETRY_DELAY)
+
+    def resync(self):
+        """Replace the local copy with a snapshot of the primary."""
+        status, data = self.client.get_json("/replication/snapshot")
+        if status != 200:
+            raise ValueError(f"snapshot returned {status}")
+        with self.lock:
+            self._keys = {entry["key"]: entry for entry in data["keys"]}
+            self.epoch = data["epoch"]
+            self.seq = self.primary_seq = data["seq"]
+            self.last_contact = time.time()
+            self.resyncs += 1
+        self.ready.set()
+
+    def poll(self):
+        """Wait for and apply the next batch of changes from the primary."""
+        query = urllib.parse.urlencode(
+            {"since": self.seq, "epoch": self.epoch, "wait": POLL_WAIT}
+        )
+        status, data = self.client.get_json(f"/replication/changes?{query}")
+        if status == 410:
+            self.seq = None  # Fell too far behind or the primary restarted
+            return
+        if status != 200:
+            raise ValueError(f"changes returned {status}")
+        self.apply(data["changes"])
+        with self.lock:
+            self.primary_seq = data["seq"]
+            self.last_contact = time.time()
+
+    def apply(self, changes):
+        with self.lock:
+            for change in changes:
+                entry = change["entry"]
+                if change["event"] in ("remove", "expire"):
+                    self._keys.pop(entry["key"], None)
+                else:
+                    self._keys[entry["key"]] = entry
+                self.seq = change["seq"]
+            if changes:
+                self.last_apply_delay = time.time() - changes[-1]["time"]
+
+    def find_activation(self, key, machine_id):
+        """Return the entry if ``key`` is activated on ``machine_id`` and unexpired."""
+        with self.lock:
+            entry = self._keys.get(key)
+            if entry is None or machine_id not in entry["machine_ids"]:
+                return None
+            expiration_date = entry["expiration_date"]
+            if expiration_date and datetime.now().isoformat() > expiration_date:
+                return None
+            return copy_entry(entry)
+
+    def status(self):
+        with self.lock:
+            lag = None
+            if self.seq is not None and self.primary_seq is not None:
+                lag = self.primary_seq - self.seq
+            return {
+                "mode": "replica",
+                "primary": self.primary_url,
+                "ready": self.ready.is_set(),
+                "keys": len(self._keys),
+                "applied_seq": self.seq,
+                "primary_seq": self.primary_seq,
+                "lag_changes": lag,
+                "last_apply_delay_seconds": self.last_apply_delay,
+                "seconds_since_contact": (
+                    time.time() - self.last_contact if self.last_contact else None
+                ),
+                "resyncs": self.resyncs,
+                "last_error": self.last_error,
+            }
+
+    def forward(self):
+        """Send the current request to the primary and relay its response."""
+        headers = {
+            name: request.headers[name]
+            for name in FORWARDED_REQUEST_HEADERS
+            if name in request.headers
+        }
+        # Keep the client's address for the primary's request log
+        headers["X-Forwarded-For"] = ", ".join(
+            filter(None, (request.headers.get("X-Forwarded-For"), request.remote_addr))
+        )
+        path = request.full_path if request.query_string else request.path
+        try:
+            status, response_headers, body = self.client.request(
+                request.method, path, request.get_data(), headers, stream=True
+            )
+        except (OSError, http.client.HTTPException):
+            return (
+                jsonify(
+                    {"status": "unavailable", "message": "The primary is unreachable."}
+                ),
+                503,
+            )
+        response = Response(body, status=status)
+        for name, value in response_headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                response.headers[name] = value
+        return response
+
+
+# The replica this process runs as, if any
+replica = Replica(PRIMARY_URL) if PRIMARY_URL else None
+
+
+def install(app, replica):
+    """Route ``app``'s requests through ``replica``."""
+    local_endpoints = {
+        "main.liveness",
+        "main.replication_status",
+        # The request log endpoints report on this replica's own log
+        "main.get_log_stats",
+        "main.get_recent_logs",
+        "main.stream_recent_logs",
+        "main.get_request_logs",
+    }
+
+    @app.before_request
+    def serve_or_forward():
+        if request.endpoint in local_endpoints:
+            return None
+        if request.endpoint == "main.readiness":
+            if not replica.ready.is_set():
+                return jsonify({"status": "starting"}), 503
+            return jsonify({"status": "ready"}), 200
+
+        if (
+            request.endpoint == "main.stream_changes"
+            or request.args.get("wait", default=0, type=float) > 0
+        ):
+            # Streams and long polls are not relayed; clients reconnect to
+            # the primary
+            return redirect(replica.primary_url.rstrip("/") + request.full_path, 307)
+
+        want_lease = request.args.get("lease", "false").lower() == "true"
+        if request.endpoint == "main.activate_or_validate_key" and (
+            SHARED_LEASE_KEY or not want_lease
+        ):
+            key = request.args.get("key")
+            machine_id = request.args.get("machine_id")
+            entry = replica.find_activation(key, machine_id)
+            if entry is not None:
+                log_request(
+                    action="validate_key",
+                    key=key,
+                    machine_id=machine_id,
+                    product_id=entry["product_id"],
+                )
+                response = {
+                    "status": "valid",
+                    "message": "The key and machine ID are valid and activated.",
+                    "product_id": entry["product_id"],
+                }
+                if want_lease:
+                    response.update(issue_lease(entry, machine_id))
+                return jsonify(response), 200
+
+        return replica.forward()
@@ -1,12 +1,88 @@
 from datetime import datetime, timedelta
-from flask import Blueprint, jsonify, request, send_file, Flask
-from .utils import log_request, load_keys, save_keys, generate_key, serve_file
+from flask import Blueprint, jsonify, request
+from flask import Response, stream_with_context
+from .utils import (
+    ABS_PATH,
+    KEY_FORMAT,
+    LOGS_FILE,
+    add_key,
+    add_keys,
+    change_journal,
+    find_key,
+    generate_keys,
+    get_key_format,
+    get_lease_signer,
+    issue_lease,
+    key_store,
+    keys_for_machine,
+    keys_lock,
+    lease_revocations,
+    load_keys,
+    log_request,
+    log_requests,
+    log_rollups,
+    logs_lock,
+    page_keys,
+    product_stats,
+    recent_logs,
+    release_seats,
+    remove_key,
+    serve_file,
+    update_keys,
+    wait_for_changes,
+)
+from .leases import LeaseError
+from .key_format import is_signed_key
+from .exports import keys_export_path, send_export
+from .journal import copy_entry
+from .replication import replica
+from .snapshots import list_snapshots, start_snapshot
+from .analytics import BUCKETS, DIMENSIONS
 from .auth import USERS, check_auth
-from .utils import KEYS_FILE, LOGS_FILE, ABS_PATH
+from .codec import dumps
+from threading import BoundedSemaphore
+import base64
 import os
+import time
 
 bp = Blueprint("main", __name__)
 
+KEY_FORMATS = ("uuid", "signed")
+MAX_BULK_KEYS = 10000
+# Widest expiry window /product-stats reports on, in days
+MAX_EXPIRY_WINDOW_DAYS = 3650
+# Lifetime of a Server-Sent Events connection and the reconnect delay after it
+EVENT_STREAM_SECONDS = int(os.getenv("EVENT_STREAM_SECONDS", 300))
+EVENT_STREAM_RETRY_MS = 1000
+# Event streams and long polls hold a server thread while they wait. Only
+# this many may wait at once, half of start.py's THREADS by default, so
+# requests that answer straight away always find a free thread.
+MAX_EVENT_STREAMS = int(
+    os.getenv("MAX_EVENT_STREAMS", max(1, int(os.getenv("THREADS", 8)) // 2))
+)
+event_stream_slots = BoundedSemaphore(MAX_EVENT_STREAMS)
+
+
+def _fixed_reply(data, status):
+    """Return a view result for a reply that never changes, encoded only once."""
+    body = dumps(data) + b"\n"
+    return lambda: Response(body, status=status, mimetype="application/json")
+
+
+INVALID_KEY_REPLY = _fixed_reply(
+    {"status": "invalid", "message": "The key is invalid."}, 400
+)
+EXPIRED_KEY_REPLY = _fixed_reply(
+    {"status": "expired", "message": "The key has expired."}, 400
+)
+LIMIT_EXCEEDED_REPLY = _fixed_reply(
+    {
+        "status": "limit_exceeded",
+        "message": "The key has reached its machine usage limit.",
+    },
+    400,
+)
+
 
 # Serve files from the '.well-known' directory
 @bp.route("/.well-known/pki-validation/<path:filename>", methods=["GET"])
@@ -28,6 +104,20 @@ def download_file(filename):
     return serve_file(directory, filename, as_attachment=as_attachment)
 
 
+# Liveness probe: the process is up and serving requests
+@bp.route("/healthz", methods=["GET"])
+def liveness():
+    return jsonify({"status": "alive"}), 200
+
+
+# Readiness probe: the key store and log statistics have been loaded
+@bp.route("/readyz", methods=["GET"])
+def readiness():
+    if not (key_store.ready.is_set() and log_rollups.ready.is_set()):
+        return jsonify({"status": "starting"}), 503
+    return jsonify({"status": "ready"}), 200
+
+
 # Endpoint for generating a key
 @bp.route("/generate-key", methods=["POST"])
 def generate_key_route():
@@ -42,17 +132,33 @@ def generate_key_route():
     expiration_days = request.args.get("expiration_days", default=0, type=int)
     machine_limit = request.args.get("machine_limit", default=1, type=int)
     product_id = request.args.get("product_id")
+    key_format = request.args.get("key_format", KEY_FORMAT)
 
     if not product_id:  # Ensure product_id is provided
         return jsonify({"status": "error", "message": "product_id is required."}), 400
+    if key_format not in KEY_FORMATS:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": f"key_format must be one of {', '.join(KEY_FORMATS)}.",
+                }
+            ),
+            400,
+        )
 
     # Generate the new key using the extracted parameters
-    new_key = generate_key(expiration_days, machine_limit, product_id)
-    keys = load_keys()
-    keys.append(new_key)
-    save_keys(keys)
+    (new_key,) = generate_keys(
+        1, expiration_days, machine_limit, product_id, key_format
+    )
+    add_key(new_key)
 
-    log_request(action="generate_key", key=new_key["key"], username=user["role"])
+    log_request(
+        action="generate_key",
+        key=new_key["key"],
+        username=user["role"],
+        product_id=product_id,
+    )
 
     return (
         jsonify({"status": "success", "key": new_key["key"]}),
@@ -60,54 +166,112 @@ def generate_key_route():
     )
 
 
+# Endpoint for generating many keys at once
+@bp.route("/generate-keys", methods=["POST"])
+def generate_keys_route():
+    user = check_auth()
+    if not user:
+        return (
+            jsonify({"status": "unauthorized", "message": "Invalid credentials."}),
+            401,
+        )
+
+    count = request.args.get("count", default=1, type=int)
+    expiration_days = request.args.get("expiration_days", default=0, type=int)
+    machine_limit = request.args.get("machine_limit", default=1, type=int)
+    product_id = request.args.get("product_id")
+    key_format = request.args.get("key_format", KEY_FORMAT)
+
+    if not product_id:
+        return jsonify({"status": "error", "message": "product_id is required."}), 400
+    if not 1 <= count <= MAX_BULK_KEYS or key_format not in KEY_FORMATS:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": f"count must be between 1 and {MAX_BULK_KEYS} and "
+                    f"key_format one of {', '.join(KEY_FORMATS)}.",
+                }
+            ),
+            400,
+        )
+
+    new_keys = generate_keys(
+        count, expiration_days, machine_limit, product_id, key_format
+    )
+    add_keys(new_keys)  # One write to the key store for the whole batch
+
+    # One log append for the whole batch too
+    log_requests(
+        action="generate_key",
+        keys=[new_key["key"] for new_key in new_keys],
+        username=user["role"],
+        product_id=product_id,
+    )
+
+    return (
+        jsonify({"status": "success", "keys": [k["key"] for k in new_keys]}),
+        201,
+    )
+
+
 # Endpoint for activating or validating a key
 @bp.route("/key", methods=["POST"])
 def activate_or_validate_key():
     data = request.args  # Change to get data from args
     key = data.get("key")
     machine_id = data.get("machine_id")
+    # Optionally return a signed lease the client can verify offline
+    want_lease = data.get("lease", "false").lower() == "true"
+
+    # Reject forged or mistyped keys in the self-verifying format up front,
+    # before touching the key store or the request log
+    if is_signed_key(key) and not get_key_format().verify(key):
+        return INVALID_KEY_REPLY()
 
-    keys = load_keys()
-    current_time = datetime.now().isoformat()
+    # Hold the keys lock for the whole check-then-activate sequence so two
+    # concurrent activations cannot both pass the machine_limit check.
+    with keys_lock:
+        entry = find_key(key)
+        current_time = datetime.now().isoformat()
 
-    for entry in keys:
-        if entry["key"] == key:
+        if entry is not None:
             # Check if the key has expired
             if entry["expiration_date"] and current_time > entry["expiration_date"]:
-                log_request(action="key_expired", key=key, machine_id=machine_id)
-                return (
-                    jsonify({"status": "expired", "message": "The key has expired."}),
-                    400,
+                log_request(
+                    action="key_expired",
+                    key=key,
+                    machine_id=machine_id,
+                    product_id=entry["product_id"],
                 )
+                return EXPIRED_KEY_REPLY()
 
             if machine_id in entry["machine_ids"]:
-                log_request(action="validate_key", key=key, machine_id=machine_id)
-                return (
-                    jsonify(
-                        {
-                            "status": "valid",
-                            "message": "The key and machine ID are valid and activated.",
-                            "product_id": entry[
-                                "product_id"
-                            ],  # Include product_id in the response
-                        }
-                    ),
-                    200,
+                log_request(
+                    action="validate_key",
+                    key=key,
+                    machine_id=machine_id,
+                    product_id=entry["product_id"],
                 )
+                response = {
+                    "status": "valid",
+                    "message": "The key and machine ID are valid and activated.",
+                    "product_id": entry[
+                        "product_id"
+                    ],  # Include product_id in the response
+                }
+                if want_lease:
+                    response.update(issue_lease(entry, machine_id))
+                return jsonify(response), 200
 
             if len(entry["machine_ids"]) >= entry["machine_limit"]:
                 log_request(
-                    action="machine_limit_exceeded", key=key, machine_id=machine_id
-                )
-                return (
-                    jsonify(
-                        {
-                            "status": "limit_exceeded",
-                            "message": "The key has reached its machine usage limit.",
-                        }
-                    ),
-                    400,
+                    action="machine_limit_exceeded",
+                    key=key,
+                    machine_id=machine_id,
+                    product_id=entry["product_id"],
                 )
+                return LIMIT_EXCEEDED_REPLY()
 
             # Key activation logic
             entry["machine_ids"].append(machine_id)
@@ -119,29 +283,30 @@ def activate_or_validate_key():
                     datetime.now() + timedelta(days=entry["expiration_days"])
                 ).isoformat()
 
-            save_keys(keys)
-
-            log_request(action="activate_key", key=key, machine_id=machine_id)
+            update_keys(entry)
 
-            return (
-                jsonify(
-                    {
-                        "status": "activated",
-                        "message": "The key has been activated for the new machine.",
-                        "product_id": entry[
-                            "product_id"
-                        ],  # Include product_id in the response
-                        "expiration_date": entry[
-                            "expiration_date"
-                        ],  # Return the new expiration date
-                    }
-                ),
-                200,
+            log_request(
+                action="activate_key",
+                key=key,
+                machine_id=machine_id,
+                product_id=entry["product_id"],
             )
 
-    log_request(action="invalid_key_attempt", key=key, machine_id=machine_id)
+            response = {
+                "status": "activated",
+                "message": "The key has been activated for the new machine.",
+                "product_id": entry["product_id"],  # Include product_id in the response
+                "expiration_date": entry[
+                    "expiration_date"
+                ],  # Return the new expiration date
+            }
+            if want_lease:
+                response.update(issue_lease(entry, machine_id))
+            return jsonify(response), 200
 
-    return jsonify({"status": "invalid", "message": "The key is invalid."}), 400
+        log_request(action="invalid_key_attempt", key=key, machine_id=machine_id)
+
+        return INVALID_KEY_REPLY()
 
 
 # Endpoint for to update expiration for all keys of a specific product ID
@@ -183,20 +348,25 @@ def update_expiration_for_product():
             400,
         )
 
-    keys = load_keys()
-    updated_keys = []
-    for entry in keys:
-        if entry["product_id"] == product_id:
-            if entry["expiration_date"]:
-                current_expiration = datetime.fromisoformat(entry["expiration_date"])
-                new_expiration = current_expiration + timedelta(days=additional_days)
-                entry["expiration_date"] = new_expiration.isoformat()
-            else:
-                # If there is no expiration date, we can set it to unlimited or leave it unchanged
-                entry["expiration_date"] = None
-            updated_keys.append(entry)
-
-    save_keys(keys)
+    with keys_lock:
+        keys = load_keys()
+        updated_keys = []
+        for entry in keys:
+            if entry["product_id"] == product_id:
+                if entry["expiration_date"]:
+                    current_expiration = datetime.fromisoformat(
+                        entry["expiration_date"]
+                    )
+                    new_expiration = current_expiration + timedelta(
+                        days=additional_days
+                    )
+                    entry["expiration_date"] = new_expiration.isoformat()
+                else:
+                    # If there is no expiration date, we can set it to unlimited or leave it unchanged
+                    entry["expiration_date"] = None
+                updated_keys.append(entry)
+
+        update_keys(*updated_keys)
     log_request(
         action="update_expiration_for_product", product_id=product_id, username=username
     )
@@ -238,9 +408,15 @@ def get_request_logs():
         )
 
     if os.path.exists(LOGS_FILE):
-        log_request(action="retrieve_request_logs", username=username)
-
-        return send_file(LOGS_FILE, as_attachment=True)
+        # A 304 transfers nothing, so only actual retrievals are logged; the
+        # download includes its own entry, so the next poll can get a 304
+        return send_export(
+            LOGS_FILE,
+            append_lock=logs_lock,
+            on_send=lambda: log_request(
+                action="retrieve_request_logs", username=username
+            ),
+        )
     else:
         return (
             jsonify({"status": "error", "message": "Request log file not found."}),
@@ -273,9 +449,12 @@ def get_keys_file():
             403,
         )
 
-    if os.path.exists(KEYS_FILE):
-        log_request(action="retrieve_keys_file", username=username)
-        return send_file(KEYS_FILE, as_attachment=True)
+    keys_path = keys_export_path(key_store)
+    if os.path.exists(keys_path):
+        response = send_export(keys_path, download_name="keys.json")
+        if response.status_code != 304:
+            log_request(action="retrieve_keys_file", username=username)
+        return response
     else:
         return jsonify({"status": "error", "message": "Keys file not found."}), 404
 
@@ -312,15 +491,39 @@ def get_key_info():
             400,
         )
 
-    keys = load_keys()
-    for entry in keys:
-        if entry["key"] == key:
-            log_request(action="get_key_info", key=key, username=username)
-            return jsonify({"status": "success", "key_info": entry}), 200
+    entry = find_key(key)
+    if entry is not None:
+        log_request(
+            action="get_key_info",
+            key=key,
+            username=username,
+            product_id=entry["product_id"],
+        )
+        return jsonify({"status": "success", "key_info": entry}), 200
 
     return jsonify({"status": "error", "message": "Key not found."}), 404
 
 
+def _apply_key_edits(entry, data):
+    """Apply the optional edit fields in ``data`` to ``entry``."""
+    expiration_days = data.get("expiration_days")
+    machine_limit = data.get("machine_limit")
+    activated = data.get("activated")
+
+    # Update fields
+    if expiration_days is not None:
+        expiration_date = (
+            (datetime.now() + timedelta(days=expiration_days)).isoformat()
+            if expiration_days > 0
+            else None
+        )
+        entry["expiration_date"] = expiration_date
+    if machine_limit is not None:
+        entry["machine_limit"] = machine_limit
+    if activated is not None:
+        entry["activated"] = activated
+
+
 # Endpoint to edit key information
 @bp.route("/edit-key", methods=["PUT"])
 def edit_key_info():
@@ -354,28 +557,17 @@ def edit_key_info():
             400,
         )
 
-    keys = load_keys()
-    for entry in keys:
-        if entry["key"] == key:
-            expiration_days = data.get("expiration_days")
-            machine_limit = data.get("machine_limit")
-            activated = data.get("activated")
-
-            # Update fields
-            if expiration_days is not None:
-                expiration_date = (
-                    (datetime.now() + timedelta(days=expiration_days)).isoformat()
-                    if expiration_days > 0
-                    else None
-                )
-                entry["expiration_date"] = expiration_date
-            if machine_limit is not None:
-                entry["machine_limit"] = machine_limit
-            if activated is not None:
-                entry["activated"] = activated
-
-            save_keys(keys)
-            log_request(action="edit_key_info", key=key, username=username)
+    with keys_lock:
+        entry = find_key(key)
+        if entry is not None:
+            _apply_key_edits(entry, data)
+            update_keys(entry)
+            log_request(
+                action="edit_key_info",
+                key=key,
+                username=username,
+                product_id=entry["product_id"],
+            )
 
             return (
                 jsonify(
@@ -391,6 +583,89 @@ def edit_key_info():
     return jsonify({"status": "error", "message": "Key not found."}), 404
 
 
+# Endpoint to apply the same edit to many keys with a single write
+@bp.route("/edit-keys", methods=["PUT"])
+def edit_keys_info():
+    error = _admin_auth_error("User is not authorized to edit keys.")
+    if error:
+        return error
+    username = request.authorization.username
+
+    data = request.json
+    keys = data.get("keys")
+    if not isinstance(keys, list) or not 1 <= len(keys) <= MAX_BULK_KEYS:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": f"keys must be a list of 1 to {MAX_BULK_KEYS} keys.",
+                }
+            ),
+            400,
+        )
+
+    with keys_lock:
+        updated = []
+        not_found = []
+        for key in keys:
+            entry = find_key(key)
+            if entry is None:
+                not_found.append(key)
+                continue
+            _apply_key_edits(entry, data)
+            updated.append(entry)
+        if updated:
+            update_keys(*updated)
+
+    if updated:
+        log_requests(
+            action="edit_key_info",
+            keys=[entry["key"] for entry in updated],
+            username=username,
+            product_ids=[entry["product_id"] for entry in updated],
+        )
+    return (
+        jsonify({"status": "success", "updated": len(updated), "not_found": not_found}),
+        200,
+    )
+
+
+# Endpoint to search keys a page at a time
+@bp.route("/keys/search", methods=["GET"])
+def search_keys():
+    error = _admin_auth_error("User is not authorized to access this information.")
+    if error:
+        return error
+    username = request.authorization.username
+
+    text = request.args.get("key", "").lower()
+    product_id = request.args.get("product_id")
+    activated = request.args.get("activated")
+    machine_id = request.args.get("machine_id")
+    cursor = max(request.args.get("cursor", default=0, type=int), 0)
+    limit = min(max(request.args.get("limit", default=100, type=int), 1), 1000)
+
+    def match(entry):
+        return (
+            (not text or text in entry["key"].lower())
+            and (not product_id or entry["product_id"] == product_id)
+            and (activated is None or entry["activated"] == (activated == "true"))
+        )
+
+    if machine_id:
+        # The machine index finds these keys without a scan
+        keys = [entry for entry in keys_for_machine(machine_id) if match(entry)]
+        next_cursor = None
+    else:
+        keys, next_cursor = page_keys(cursor, limit, match)
+
+    log_request(action="search_keys", username=username, product_id=product_id)
+    return (
+        jsonify({"status": "success", "keys": keys, "next_cursor": next_cursor}),
+        200,
+    )
+
+
 @bp.route("/delete-key", methods=["DELETE"])
 def delete_key():
     # Check admin authorization
@@ -421,16 +696,498 @@ def delete_key():
     if not key:
         return jsonify({"status": "error", "message": "Key parameter is missing"}), 400
 
-    keys = load_keys()
-
-    log_request(action="delete_key", key=key, username=username)
-    for entry in keys:
-        if entry["key"] == key:
-            keys.remove(entry)
-            save_keys(keys)
-            return (
-                jsonify({"status": "success", "message": "Key deleted successfully"}),
-                200,
-            )
+    entry = remove_key(key)
+    log_request(
+        action="delete_key",
+        key=key,
+        username=username,
+        product_id=entry["product_id"] if entry else None,
+    )
+    if entry is not None:
+        return (
+            jsonify({"status": "success", "message": "Key deleted successfully"}),
+            200,
+        )
 
     return jsonify({"status": "error", "message": "Key not found"}), 404
+
+
+def _admin_auth_error(message):
+    """Return an error response unless the caller is an admin."""
+    user = check_auth()
+    if not user:
+        return (
+            jsonify({"status": "unauthorized", "message": "Invalid credentials."}),
+            401,
+        )
+    if user["role"] != "admin":
+        return jsonify({"status": "forbidden", "message": message}), 403
+    return None
+
+
+# Endpoint for aggregated request log statistics
+@bp.route("/log-stats", methods=["GET"])
+def get_log_stats():
+    error = _admin_auth_error("User is not authorized to access request logs.")
+    if error:
+        return error
+
+    if not log_rollups.ready.is_set():
+        return (
+            jsonify({"status": "error", "message": "Log statistics are loading."}),
+            503,
+        )
+
+    group_by = [name for name in request.args.get("group_by", "").split(",") if name]
+    bucket = request.args.get("bucket")
+    unknown = [name for name in group_by if name not in DIMENSIONS]
+    if unknown or (bucket and bucket not in BUCKETS):
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": f"group_by must be a subset of {', '.join(DIMENSIONS)} "
+                    f"and bucket one of {', '.join(BUCKETS)}.",
+                }
+            ),
+            400,
+        )
+
+    # Any dimension can also be given as a filter, e.g. ?action=activate_key
+    filters = {name: request.args[name] for name in DIMENSIONS if name in request.args}
+    results = log_rollups.query(
+        group_by=group_by,
+        bucket=bucket,
+        since=request.args.get("since"),
+        until=request.args.get("until"),
+        filters=filters,
+    )
+    return jsonify({"status": "success", "results": results}), 200
+
+
+# Endpoint for per-product key statistics
+@bp.route("/product-stats", methods=["GET"])
+def get_product_stats():
+    error = _admin_auth_error("User is not authorized to access key statistics.")
+    if error:
+        return error
+
+    product_id = request.args.get("product_id")
+    expiring_within_days = request.args.get("expiring_within_days", default=7, type=int)
+    if not 0 <= expiring_within_days <= MAX_EXPIRY_WINDOW_DAYS:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": "expiring_within_days must be between 0 and "
+                    f"{MAX_EXPIRY_WINDOW_DAYS}.",
+                }
+            ),
+            400,
+        )
+
+    key_store.refresh()  # Apply pending expirations before reporting
+    products = product_stats.snapshot(product_id, expiring_within_days)
+    return jsonify({"status": "success", "products": products}), 200
+
+
+# Endpoint to look up the keys activated on a machine
+@bp.route("/machine-keys", methods=["GET"])
+def get_machine_keys():
+    error = _admin_auth_error("User is not authorized to access this information.")
+    if error:
+        return error
+    username = request.authorization.username
+
+    machine_id = request.args.get("machine_id")
+    if not machine_id:
+        return (
+            jsonify({"status": "error", "message": "machine_id is required."}),
+            400,
+        )
+
+    entries = keys_for_machine(machine_id)
+    log_request(action="get_machine_keys", machine_id=machine_id, username=username)
+    return jsonify({"status": "success", "keys": entries}), 200
+
+
+# Endpoint to free seats: one machine on one key, or whole machines on all keys
+@bp.route("/release-seat", methods=["DELETE"])
+def release_seat():
+    error = _admin_auth_error("User is not authorized to edit keys.")
+    if error:
+        return error
+    username = request.authorization.username
+
+    # Repeat machine_id to release several decommissioned hosts at once
+    machine_ids = request.args.getlist("machine_id")
+    key = request.args.get("key")
+    if not machine_ids:
+        return (
+            jsonify({"status": "error", "message": "machine_id is required."}),
+            400,
+        )
+
+    released = release_seats(machine_ids, key=key)
+    if released:
+        log_requests(
+            action="release_seat",
+            keys=[entry["key"] for entry in released],
+            username=username,
+            product_ids=[entry["product_id"] for entry in released],
+        )
+
+    if key is not None and not released:
+        return (
+            jsonify({"status": "error", "message": "Machine is not activated on key."}),
+            404,
+        )
+
+    return (
+        jsonify(
+            {
+                "status": "success",
+                "message": f"Released seats on {len(released)} keys.",
+                "keys": [entry["key"] for entry in released],
+            }
+        ),
+        200,
+    )
+
+
+# Endpoint for verifying a lease returned by /key
+@bp.route("/verify-lease", methods=["POST"])
+def verify_lease():
+    token = request.args.get("lease")
+    if not token:
+        return jsonify({"status": "error", "message": "lease is required."}), 400
+
+    try:
+        payload = get_lease_signer().decode(token)
+    except LeaseError as e:
+        return jsonify({"status": e.status, "message": e.message}), 400
+
+    if lease_revocations.is_revoked(payload):
+        return (
+            jsonify({"status": "revoked", "message": "The lease has been revoked."}),
+            400,
+        )
+
+    return (
+        jsonify(
+            {
+                "status": "valid",
+                "message": "The lease is valid.",
+                "key": payload["key"],
+                "machine_id": payload["mid"],
+                "product_id": payload["pid"],
+                "lease_expires_at": payload["exp"],
+            }
+        ),
+        200,
+    )
+
+
+# Endpoint for the list of revoked leases, for offline verification
+@bp.route("/lease-revocations", methods=["GET"])
+def get_lease_revocations():
+    # Keys are identified by fingerprint so the list can be public
+    return (
+        jsonify(
+            {
+                "status": "success",
+                "ttl": lease_revocations.ttl,
+                "revoked": lease_revocations.snapshot(),
+            }
+        ),
+        200,
+    )
+
+
+# Endpoint for the public key that verifies Ed25519 leases
+@bp.route("/lease-public-key", methods=["GET"])
+def get_lease_public_key():
+    signer = get_lease_signer()
+    if signer.public_key is None:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": f"Leases are signed with {signer.algorithm}, "
+                    "which has no public key.",
+                }
+            ),
+            404,
+        )
+    return (
+        jsonify(
+            {
+                "status": "success",
+                "algorithm": signer.algorithm,
+                "public_key": base64.b64encode(signer.public_key).decode(),
+            }
+        ),
+        200,
+    )
+
+
+def _busy_response():
+    return (
+        jsonify(
+            {
+                "status": "error",
+                "message": "Too many open streams and long polls, retry later.",
+            }
+        ),
+        503,
+        {"Retry-After": str(EVENT_STREAM_RETRY_MS // 1000)},
+    )
+
+
+def _resync_response():
+    return (
+        jsonify(
+            {
+                "status": "resync",
+                "message": "Changes are no longer available, reload the keys from "
+                "/replication/snapshot or /keys.",
+                "epoch": change_journal.epoch,
+            }
+        ),
+        410,
+    )
+
+
+# Endpoint for a consistent copy of all keys, the starting point of a replica
+@bp.route("/replication/snapshot", methods=["GET"])
+def replication_snapshot():
+    error = _admin_auth_error("User is not authorized to replicate keys.")
+    if error:
+        return error
+
+    # The sequence number must match the copied keys exactly
+    with keys_lock:
+        keys = [copy_entry(entry) for entry in load_keys()]
+        seq = change_journal.seq
+    return (
+        jsonify({"epoch": change_journal.epoch, "seq": seq, "keys": keys}),
+        200,
+    )
+
+
+# Endpoint for key changes after a sequence number, long-polled by replicas
+# and other consumers that keep their own copy of the keys
+@bp.route("/changes", methods=["GET"])
+@bp.route("/replication/changes", methods=["GET"])
+def get_changes():
+    error = _admin_auth_error("User is not authorized to follow key changes.")
+    if error:
+        return error
+
+    since = request.args.get("since", type=int)
+    limit = min(request.args.get("limit", default=1000, type=int), 10000)
+    wait = min(request.args.get("wait", default=0, type=float), 30)
+    if since is None:
+        return jsonify({"status": "error", "message": "since is required."}), 400
+
+    if wait > 0 and not event_stream_slots.acquire(blocking=False):
+        return _busy_response()
+    try:
+        changes = wait_for_changes(since, request.args.get("epoch"), limit, wait)
+    finally:
+        if wait > 0:
+            event_stream_slots.release()
+    if changes is None:
+        return _resync_response()
+    return (
+        jsonify(
+            {
+                "epoch": change_journal.epoch,
+                "seq": change_journal.seq,
+                "changes": changes,
+            }
+        ),
+        200,
+    )
+
+
+# Endpoint for key changes as Server-Sent Events
+@bp.route("/changes/stream", methods=["GET"])
+def stream_changes():
+    error = _admin_auth_error("User is not authorized to follow key changes.")
+    if error:
+        return error
+
+    # EventSource resumes with the id of the last event it received
+    epoch = request.args.get("epoch")
+    since = request.args.get("since", type=int)
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if ":" in last_event_id:
+        epoch, _, last_seq = last_event_id.partition(":")
+        since = int(last_seq) if last_seq.isdigit() else None
+    if since is None:
+        since = change_journal.seq  # Only changes from now on
+    if change_journal.changes_since(since, epoch, limit=0) is None:
+        return _resync_response()
+
+    def fetch(since):
+        changes = wait_for_changes(since, epoch, 1000, 15)
+        if changes is None:
+            return None
+        events = [
+            (f"{change_journal.epoch}:{c['seq']}", c["event"], c) for c in changes
+        ]
+        return (changes[-1]["seq"] if changes else since), events
+
+    return _event_stream(since, fetch, resync={"epoch": change_journal.epoch})
+
+
+def _event_stream(since, fetch, resync=None):
+    """Return a Server-Sent Events response for the events ``fetch`` finds.
+
+    ``fetch(since)`` waits briefly for new events and returns ``(since,
+    events)`` with ``events`` as ``(id, name, data)`` tuples, or ``None``
+    when the client has to start over. Answers 503 when
+    ``MAX_EVENT_STREAMS`` requests are already waiting.
+    """
+    if not event_stream_slots.acquire(blocking=False):
+        return _busy_response()
+
+    def events(since):
+        yield f"retry: {EVENT_STREAM_RETRY_MS}\n\n"
+        # Each stream holds a server thread, so it ends after a while and
+        # the client reconnects from its last event
+        deadline = time.monotonic() + EVENT_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            result = fetch(since)
+            if result is None:
+                yield f"event: resync\ndata: {dumps(resync or {}, indent=0).decode()}\n\n"
+                return
+            since, batch = result
+            if not batch:
+                yield ": keep-alive\n\n"
+            for event_id, name, data in batch:
+                yield f"id: {event_id}\nevent: {name}\ndata: {dumps(data, indent=0).decode()}\n\n"
+
+    response = Response(
+        stream_with_context(events(since)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # The server closes the response when the stream ends or the client leaves
+    response.call_on_close(event_stream_slots.release)
+    return response
+
+
+def _recent_logs_request():
+    """Parse the filters shared by /recent-logs and its stream."""
+    filters = {name: request.args[name] for name in DIMENSIONS if name in request.args}
+    limit = min(request.args.get("limit", default=100, type=int), recent_logs.size)
+    return filters, limit
+
+
+# Endpoint for the most recent request log entries, served from memory.
+# Not logged itself, so polling it does not flood the log being watched.
+@bp.route("/recent-logs", methods=["GET"])
+def get_recent_logs():
+    error = _admin_auth_error("User is not authorized to access request logs.")
+    if error:
+        return error
+
+    filters, limit = _recent_logs_request()
+    wait = min(request.args.get("wait", default=0, type=float), 30)
+    if wait > 0 and not event_stream_slots.acquire(blocking=False):
+        return _busy_response()
+    try:
+        seq, logs = recent_logs.query(
+            since=request.args.get("since", type=int),
+            limit=limit,
+            filters=filters,
+            wait=wait,
+            before=request.args.get("before", type=int),
+        )
+    finally:
+        if wait > 0:
+            event_stream_slots.release()
+    return jsonify({"status": "success", "seq": seq, "logs": logs}), 200
+
+
+# Endpoint for new request log entries as Server-Sent Events
+@bp.route("/recent-logs/stream", methods=["GET"])
+def stream_recent_logs():
+    error = _admin_auth_error("User is not authorized to access request logs.")
+    if error:
+        return error
+
+    filters, limit = _recent_logs_request()
+    since = request.args.get("since", type=int)
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    if since is None:
+        since = recent_logs.seq  # Only entries from now on
+
+    def fetch(since):
+        seq, logs = recent_logs.query(since, 1000, filters, wait=15)
+        return seq, [(str(entry["seq"]), "log", entry) for entry in logs]
+
+    return _event_stream(since, fetch)
+
+
+# Endpoint for the replication position and, on replicas, the lag
+@bp.route("/replication/status", methods=["GET"])
+def replication_status():
+    if replica is not None:
+        return jsonify(replica.status()), 200
+    return (
+        jsonify(
+            {
+                "mode": "primary",
+                "epoch": change_journal.epoch,
+                "seq": change_journal.seq,
+            }
+        ),
+        200,
+    )
+
+
+# Endpoint for taking a consistent snapshot of the keys and the request log
+@bp.route("/snapshots", methods=["POST"])
+def create_snapshot():
+    error = _admin_auth_error("User is not authorized to take snapshots.")
+    if error:
+        return error
+
+    name = start_snapshot(key_store, change_journal, LOGS_FILE, logs_lock)
+    if name is None:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": "A snapshot is already being taken.",
+                }
+            ),
+            409,
+        )
+    log_request(action="take_snapshot", username=request.authorization.username)
+    return (
+        jsonify(
+            {
+                "status": "success",
+                "message": "The snapshot is being written; it is listed by "
+                "GET /snapshots when complete.",
+                "snapshot": name,
+            }
+        ),
+        202,
+    )
+
+
+# Endpoint for listing the available snapshots, newest first
+@bp.route("/snapshots", methods=["GET"])
+def get_snapshots():
+    error = _admin_auth_error("User is not authorized to list snapshots.")
+    if error:
+        return error
+
+    return jsonify({"status": "success", "snapshots": list_snapshots()}), 200
@@ -1,5 +1,126 @@
+import os
+import threading
+import time
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from . import codec
 from .routes import bp as main_bp
+from . import replication
+from .streaming import iter_logs
+from .snapshots import SNAPSHOT_INTERVAL_HOURS, take_snapshot
+from .utils import (
+    DEFAULT_LOGS_FILE,
+    LOGS_FILE,
+    change_journal,
+    key_store,
+    log_rollups,
+    logs_lock,
+    recent_logs,
+)
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """Encodes ``jsonify`` responses and parses request bodies with the codec."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return codec.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = codec.dumps(obj, default=self.default) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
+# Let a fronting proxy send static files (X-Sendfile) instead of Python
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
 app.register_blueprint(main_bp)
+
+
+def warm_up():
+    """Load and index the key store and log rollups before reporting ready."""
+    stats = key_store.warm()
+    rss = stats["peak_rss_growth_kb"]
+    print(
+        f"Key store ready: {stats['keys']} keys loaded from {stats['source']} "
+        + (f"over {stats['shards']} shards " if stats["shards"] > 1 else "")
+        + f"in {stats['seconds']:.3f}s"
+        + (f", peak RSS +{rss} KB" if rss is not None else "")
+    )
+
+    warm_up_logs()
+    return stats
+
+
+def warm_up_logs():
+    """Load the log rollups and the recent entries from the request log."""
+    # Hold the log lock so entries written meanwhile are not counted twice
+    with logs_lock:
+        # One pass over the log fills both the rollups and the recent entries
+        log_rollups.load(recent_logs.record(iter_logs(LOGS_FILE)))
+
+
+def _warm_up_in_background():
+    try:
+        warm_up()
+    except RuntimeError as e:
+        # /readyz keeps failing; the message says how to fix the key store
+        print(f"Key store not loaded: {e}")
+        return
+    if SNAPSHOT_INTERVAL_HOURS > 0:
+        _take_scheduled_snapshots(SNAPSHOT_INTERVAL_HOURS * 3600)
+
+
+def _take_scheduled_snapshots(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            manifest = take_snapshot(key_store, change_journal, LOGS_FILE, logs_lock)
+            print(f"Wrote snapshot {manifest['name']}")
+        except OSError as e:
+            print(f"Scheduled snapshot failed: {e}")
+
+
+if replication.replica is not None:
+    # Replicas follow the primary instead of loading the local key store
+    replication.install(app, replication.replica)
+
+_started = False
+
+
+def start():
+    """Start the background work of a serving process.
+
+    Replicas start following the primary and load their own request log.
+    A primary warms up in the background so the liveness endpoint answers
+    immediately; /readyz reports 503 until the store is loaded. Importing the package does not
+    start anything, so the command-line tools work on the files alone.
+    """
+    global _started
+    if _started:
+        return
+    if replication.replica is not None and os.path.abspath(
+        LOGS_FILE
+    ) == os.path.abspath(DEFAULT_LOGS_FILE):
+        raise RuntimeError(
+            "A replica must log to its own file, set KEYSERVER_LOGS_FILE"
+        )
+    _started = True
+    if replication.replica is not None:
+        replication.replica.start()
+        # The log endpoints are served from the replica's own log
+        threading.Thread(
+            target=warm_up_logs, name="request-log-warm-up", daemon=True
+        ).start()
+    else:
+        threading.Thread(
+            target=_warm_up_in_background, name="key-store-warm-up", daemon=True
+        ).start()
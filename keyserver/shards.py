@@ -0,0 +1,70 @@
+"""Resharding tool for the key store.
+
+Set ``KEY_SHARDS`` to split the keys over that many files by key hash
+(``keys.0-of-4.json`` ... ``keys.3-of-4.json``); the default of 1 keeps the
+single ``keys.json``. Changing the count needs the keys to be redistributed
+first, with the server stopped::
+
+    python -m keyserver.shards reshard 4
+    python -m keyserver.shards reshard 1   # back to a single keys.json
+
+The files keep their format (pretty-printed or line-delimited JSON), and
+binary indexes are rebuilt for shards that had one.
+"""
+
+import os
+import sys
+from .store import Shard, existing_shard_paths, shard_of, shard_paths
+from .streaming import detect_format, iter_keys
+
+
+def reshard(path, count):
+    """Redistribute the keys stored for ``path`` over ``count`` shards.
+
+    Returns the number of keys moved. New files are written before the old
+    ones are removed, so an interrupted run leaves the old layout intact.
+    """
+    old_paths = existing_shard_paths(path)
+    new_paths = shard_paths(path, count)
+    if sorted(old_paths) == sorted(new_paths):
+        return None
+
+    new_shards = [Shard(shard_path) for shard_path in new_paths]
+    file_format = detect_format(old_paths[0]) if old_paths else None
+    had_index = any(os.path.exists(p + ".idx") for p in old_paths)
+    # Files from an interrupted run can hold the same keys twice
+    seen = set()
+    for old_path in old_paths:
+        for entry in iter_keys(old_path):
+            if entry["key"] not in seen:
+                seen.add(entry["key"])
+                new_shards[shard_of(entry["key"], count)].keys.append(entry)
+
+    for shard in new_shards:
+        shard.format = file_format
+        shard.persist()
+        if had_index:
+            shard.write_index()
+
+    for old_path in old_paths:
+        if old_path in new_paths:
+            continue
+        os.remove(old_path)
+        if os.path.exists(old_path + ".idx"):
+            os.remove(old_path + ".idx")
+    return len(seen)
+
+
+if __name__ == "__main__":
+    from .utils import KEYS_FILE
+
+    if len(sys.argv) != 3 or sys.argv[1] != "reshard" or not sys.argv[2].isdigit():
+        sys.exit("usage: python -m keyserver.shards reshard <count>")
+    count = int(sys.argv[2])
+    if count < 1:
+        sys.exit("The shard count must be at least 1")
+    moved = reshard(KEYS_FILE, count)
+    if moved is None:
+        print(f"The keys are already split into {count} shard(s)")
+    else:
+        print(f"Moved {moved} keys into {count} shard(s)")
@@ -0,0 +1,273 @@
+"""Point-in-time snapshots of the key store and the request log.
+
+A snapshot is a ``snapshot-<time>.tar.gz`` in ``SNAPSHOT_DIR`` holding every
+keys file, the request log and a ``manifest.json`` with their SHA-256
+checksums and the change journal position the snapshot corresponds to.
+
+Snapshots are taken online. The keys files are replaced atomically on
+every write, so opening them under the keys lock pins one consistent
+version of each file. The log is captured as the consistent view used for
+exports while the keys lock is still held, so it has exactly the requests
+the keys reflect. The locks are only held while the files are opened; the
+copy and compression run while requests keep flowing.
+
+Take and list snapshots with ``POST /snapshots`` and ``GET /snapshots``, or
+every ``SNAPSHOT_INTERVAL_HOURS``. ``POST /snapshots`` returns the name at
+once with 202 and writes the snapshot in the background; it shows up in
+``GET /snapshots`` when complete. Restore one with the server stopped::
+
+    python -m keyserver.snapshots take
+    python -m keyserver.snapshots list
+    python -m keyserver.snapshots restore snapshot-20240101T000000.tar.gz [--keys-only]
+
+Restoring verifies every checksum before replacing any file, removes the
+shard files the snapshot does not have only once its own are in place,
+redistributes the keys if ``KEY_SHARDS`` differs from the snapshot, and
+writes binary indexes so the next start loads quickly.
+"""
+
+import hashlib
+import io
+import os
+import sys
+import tarfile
+import threading
+import time
+from datetime import datetime
+from .codec import dumps, loads
+from .exports import FileView
+from .shards import reshard
+from .store import Shard, existing_shard_paths, shard_paths, write_json_atomic
+from .streaming import stable_view
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = os.getenv(
+    "SNAPSHOT_DIR", os.path.join(os.path.dirname(__file__), "snapshots")
+)
+# Number of snapshots kept; older ones are deleted after each new snapshot
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 7))
+SNAPSHOT_INTERVAL_HOURS = float(os.getenv("SNAPSHOT_INTERVAL_HOURS", 0))
+
+# Held while a snapshot started with start_snapshot() is being written
+_running = threading.Lock()
+
+
+class HashingReader(io.RawIOBase):
+    """Pass reads through from ``f`` while computing their SHA-256."""
+
+    def __init__(self, f):
+        super().__init__()
+        self._file = f
+        self.sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self._file.readinto(buffer)
+        self.sha256.update(memoryview(buffer)[:count])
+        return count
+
+
+def _add_file(tar, name, view, manifest):
+    """Add ``view`` (a :class:`FileView`) as ``name`` and record its checksum."""
+    info = tarfile.TarInfo(name)
+    info.size = view.size
+    info.mtime = int(time.time())
+    reader = HashingReader(view)
+    # tarfile expects full reads, which the raw readers do not promise
+    tar.addfile(info, io.BufferedReader(reader))
+    manifest["files"][name] = {"size": view.size, "sha256": reader.sha256.hexdigest()}
+
+
+def snapshot_name(created):
+    return f"snapshot-{created.strftime('%Y%m%dT%H%M%S%f')}.tar.gz"
+
+
+def take_snapshot(
+    key_store, journal, logs_path, logs_lock, directory=None, created=None
+):
+    """Write a consistent snapshot and return its manifest."""
+    directory = directory or SNAPSHOT_DIR
+    os.makedirs(directory, exist_ok=True)
+    created = created or datetime.now()
+
+    # Pin the current version of every file; the copy happens unlocked.
+    # Same lock order as /key: keys, then logs.
+    log_view = None
+    with key_store.lock:
+        key_store.refresh()
+        key_files = [(shard.path, open(shard.path, "rb")) for shard in key_store.shards]
+        epoch, seq = journal.epoch, journal.seq
+        if os.path.exists(logs_path):
+            with logs_lock:
+                f = open(logs_path, "rb")
+                log_view = FileView(f, *stable_view(f))
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created": created.isoformat(),
+        "epoch": epoch,
+        "seq": seq,
+        "shards": len(key_files),
+        "files": {},
+    }
+    name = snapshot_name(created)
+    path = os.path.join(directory, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with tarfile.open(tmp_path, "w:gz", compresslevel=6) as tar:
+            for key_path, f in key_files:
+                view = FileView(f, os.fstat(f.fileno()).st_size)
+                _add_file(tar, f"keys/{os.path.basename(key_path)}", view, manifest)
+            if log_view is not None:
+                _add_file(tar, "logs/request_logs.json", log_view, manifest)
+            data = dumps(manifest, indent=4)
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    finally:
+        for _, f in key_files:
+            f.close()
+        if log_view is not None:
+            log_view.close()
+    os.replace(tmp_path, path)
+
+    _prune(directory)
+    return dict(manifest, name=name, bytes=os.path.getsize(path))
+
+
+def start_snapshot(key_store, journal, logs_path, logs_lock, directory=None):
+    """Take a snapshot in a background thread and return its file name.
+
+    Returns None while a snapshot started this way is still being written.
+    """
+    if not _running.acquire(blocking=False):
+        return None
+    directory = directory or SNAPSHOT_DIR
+    created = datetime.now()
+
+    def run():
+        try:
+            take_snapshot(key_store, journal, logs_path, logs_lock, directory, created)
+        except OSError as e:
+            print(f"Snapshot {snapshot_name(created)} failed: {e}")
+        finally:
+            _running.release()
+
+    threading.Thread(target=run, name="snapshot", daemon=True).start()
+    return snapshot_name(created)
+
+
+def list_snapshots(directory=None):
+    """Return the snapshot file names in ``directory``, newest first."""
+    directory = directory or SNAPSHOT_DIR
+    if not os.path.isdir(directory):
+        return []
+    names = [
+        name
+        for name in os.listdir(directory)
+        if name.startswith("snapshot-") and name.endswith(".tar.gz")
+    ]
+    return sorted(names, reverse=True)
+
+
+def _prune(directory):
+    for name in list_snapshots(directory)[SNAPSHOT_KEEP:]:
+        os.remove(os.path.join(directory, name))
+
+
+def restore_snapshot(path, keys_path, logs_path, shards=1, keys_only=False):
+    """Restore the snapshot at ``path`` and return its manifest.
+
+    Every member is extracted next to its target and checked against the
+    manifest before any existing file is replaced.
+    """
+    with tarfile.open(path, "r:gz") as tar:
+        manifest = loads(tar.extractfile("manifest.json").read())
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version in {path}")
+
+        key_dir = os.path.dirname(keys_path)
+        targets = {}
+        for name in manifest["files"]:
+            if name.startswith("keys/"):
+                targets[name] = os.path.join(key_dir, os.path.basename(name))
+            elif name == "logs/request_logs.json" and not keys_only:
+                targets[name] = logs_path
+
+        restored = []
+        try:
+            for name, target in targets.items():
+                tmp_path = f"{target}.{os.getpid()}.restore"
+                restored.append((tmp_path, target))
+                reader = HashingReader(tar.extractfile(name))
+                with open(tmp_path, "wb") as f:
+                    while chunk := reader.read(1024 * 1024):
+                        f.write(chunk)
+                if reader.sha256.hexdigest() != manifest["files"][name]["sha256"]:
+                    raise ValueError(f"Checksum mismatch for {name} in {path}")
+        except BaseException:
+            for tmp_path, _ in restored:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+
+    # Put the restored files in place first, then drop the indexes and any
+    # shard files of the current layout that the snapshot does not replace
+    old_paths = existing_shard_paths(keys_path)
+    for tmp_path, target in restored:
+        os.replace(tmp_path, target)
+    replaced = {target for _, target in restored}
+    for old_path in old_paths:
+        if old_path not in replaced:
+            os.remove(old_path)
+        if os.path.exists(old_path + ".idx"):
+            os.remove(old_path + ".idx")
+    if not any(name.startswith("keys/") for name in targets):
+        write_json_atomic(keys_path, {"valid_keys": []})
+
+    if shards != manifest["shards"]:
+        reshard(keys_path, shards)
+    for shard_path in shard_paths(keys_path, shards):
+        shard = Shard(shard_path)
+        shard.load()
+        shard.write_index()
+    return manifest
+
+
+if __name__ == "__main__":
+    from .utils import (
+        KEY_SHARDS,
+        KEYS_FILE,
+        LOGS_FILE,
+        change_journal,
+        key_store,
+        logs_lock,
+    )
+
+    args = sys.argv[1:]
+    if args == ["take"]:
+        manifest = take_snapshot(key_store, change_journal, LOGS_FILE, logs_lock)
+        print(f"Wrote {manifest['name']} ({manifest['bytes']} bytes)")
+    elif args == ["list"]:
+        for name in list_snapshots():
+            print(name)
+    elif (
+        len(args) in (2, 3)
+        and args[0] == "restore"
+        and args[2:] in ([], ["--keys-only"])
+    ):
+        path = args[1]
+        if not os.path.exists(path):
+            path = os.path.join(SNAPSHOT_DIR, path)
+        manifest = restore_snapshot(
+            path, KEYS_FILE, LOGS_FILE, KEY_SHARDS, keys_only=len(args) == 3
+        )
+        print(f"Restored the snapshot taken at {manifest['created']}")
+    else:
+        sys.exit(
+            "usage: python -m keyserver.snapshots "
+            "take | list | restore <snapshot> [--keys-only]"
+        )
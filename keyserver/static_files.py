@@ -0,0 +1,88 @@
+"""Serving files from the downloads and pki-validation directories.
+
+Large files go through ``send_file``, which hands the open file to the
+WSGI server's ``wsgi.file_wrapper`` (zero-copy ``sendfile`` on servers that
+support it) and answers Range and If-None-Match requests. Setting
+``USE_X_SENDFILE=true`` lets a fronting proxy send the file instead.
+
+Small files, such as PKI validation tokens, are kept in a bounded LRU
+cache and served from memory until they change on disk.
+"""
+
+import mimetypes
+import os
+from collections import OrderedDict
+from threading import Lock
+from flask import current_app, request, send_file
+
+# Files up to this size are cached in memory
+SMALL_FILE_LIMIT = int(os.getenv("STATIC_CACHE_FILE_LIMIT", 64 * 1024))
+# Total size of the small file cache
+CACHE_BYTES = int(os.getenv("STATIC_CACHE_BYTES", 4 * 1024 * 1024))
+
+
+class SmallFileCache:
+    """LRU cache of file contents, keyed by path and validated by stat."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, path, stamp):
+        with self.lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != stamp:
+                return None
+            self._entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path, stamp, data):
+        with self.lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[path] = (stamp, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+small_files = SmallFileCache()
+
+
+def send_static(path, st, as_attachment=False):
+    """Send the regular file at ``path`` whose ``os.stat`` result is ``st``."""
+    stamp = (st.st_size, st.st_mtime_ns)
+    etag = f"{st.st_size}-{st.st_mtime_ns}"
+    if st.st_size > SMALL_FILE_LIMIT:
+        return send_file(path, as_attachment=as_attachment, etag=etag)
+
+    data = small_files.get(path, stamp)
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+        # Only cache what matches the stat the ETag was built from
+        if len(data) == st.st_size:
+            small_files.put(path, stamp, data)
+
+    response = current_app.response_class(
+        data,
+        mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream",
+    )
+    if as_attachment:
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=os.path.basename(path)
+        )
+    response.last_modified = st.st_mtime
+    response.set_etag(etag)
+    return response.make_conditional(
+        request.environ, accept_ranges=True, complete_length=len(data)
+    )
@@ -0,0 +1,114 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from threading import Lock
+from .store import StoreListener
+
+
+def _contribution(entry):
+    """Return what ``entry`` adds to its product's counters."""
+    expiration_date = entry["expiration_date"]
+    return (
+        entry["product_id"],
+        1 if entry["activated"] else 0,
+        len(entry["machine_ids"]),
+        entry["machine_limit"],
+        expiration_date[:10] if expiration_date else None,
+    )
+
+
+class ProductCounters:
+    __slots__ = ("total_keys", "activated_keys", "seats_used", "seat_limit", "expiry")
+
+    def __init__(self):
+        self.total_keys = 0
+        self.activated_keys = 0
+        self.seats_used = 0
+        self.seat_limit = 0
+        # Keys per expiration day (YYYY-MM-DD)
+        self.expiry = Counter()
+
+
+class ProductStats(StoreListener):
+    """Per-product key counters, updated on every key store change.
+
+    Each key's last contribution is remembered so an in-place update can
+    be applied as "subtract old, add new" without rescanning the store.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self._products = {}
+        self._contributions = {}
+
+    def reset(self, entries):
+        with self.lock:
+            self._products = {}
+            self._contributions = {}
+            for entry in entries:
+                self._apply(entry["key"], _contribution(entry))
+
+    def on_change(self, event, entry):
+        with self.lock:
+            if event in ("remove", "expire"):
+                self._apply(entry["key"], None)
+            else:
+                self._apply(entry["key"], _contribution(entry))
+
+    def _apply(self, key, contribution):
+        old = self._contributions.pop(key, None)
+        if old is not None:
+            self._count(old, -1)
+        if contribution is not None:
+            self._contributions[key] = contribution
+            self._count(contribution, 1)
+
+    def _count(self, contribution, sign):
+        product_id, activated, seats_used, seat_limit, expiry_day = contribution
+        counters = self._products.get(product_id)
+        if counters is None:
+            counters = self._products[product_id] = ProductCounters()
+        counters.total_keys += sign
+        counters.activated_keys += sign * activated
+        counters.seats_used += sign * seats_used
+        counters.seat_limit += sign * seat_limit
+        if expiry_day is not None:
+            counters.expiry[expiry_day] += sign
+            if not counters.expiry[expiry_day]:
+                del counters.expiry[expiry_day]
+        if not counters.total_keys:
+            del self._products[product_id]
+
+    def snapshot(self, product_id=None, expiring_within_days=7):
+        """Return the counters per product, optionally for a single product.
+
+        ``expiring_soon`` counts keys expiring within the next
+        ``expiring_within_days`` days; ``expiry_histogram`` breaks them down
+        per day.
+        """
+        today = datetime.now().date()
+        horizon = (today + timedelta(days=expiring_within_days)).isoformat()
+        today = today.isoformat()
+
+        with self.lock:
+            if product_id is not None:
+                products = {product_id: self._products.get(product_id)}
+            else:
+                products = self._products
+            result = {}
+            for name, counters in products.items():
+                if counters is None:
+                    continue
+                histogram = {
+                    day: count
+                    for day, count in sorted(counters.expiry.items())
+                    if today <= day <= horizon
+                }
+                result[name] = {
+                    "total_keys": counters.total_keys,
+                    "activated_keys": counters.activated_keys,
+                    "seats_used": counters.seats_used,
+                    "seat_limit": counters.seat_limit,
+                    "expiring_soon": sum(histogram.values()),
+                    "expiry_histogram": histogram,
+                }
+        return result
@@ -0,0 +1,431 @@
+import glob
+import marshal
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, RLock
+from .codec import dumps
+from .streaming import FORMAT_JSONL, detect_format, read_keys, write_jsonl
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temporary file and move it over ``path``.
+
+    Readers (including ``send_file``) either see the old file or the new
+    one, never a partially written one.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(dumps(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def file_stamp(path):
+    """Return a cheap change marker for ``path`` (size, mtime in ns)."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class StoreListener:
+    """Receives every change made through a :class:`KeyStore`.
+
+    Callbacks run while the store lock is held, so they see changes in the
+    order they were made and must not block.
+    """
+
+    def reset(self, entries):
+        """The whole key set was (re)loaded or replaced."""
+
+    def on_change(self, event, entry):
+        """``entry`` was ``"add"``-ed, ``"update"``-d, ``"remove"``-d or ``"expire"``-d."""
+
+
+def shard_paths(path, count):
+    """Return the files of a key store at ``path`` split into ``count`` shards.
+
+    A single shard is the plain keys file, so unsharded stores keep their
+    original layout.
+    """
+    if count == 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f"{root}.{i}-of-{count}{ext}" for i in range(count)]
+
+
+def existing_shard_paths(path):
+    """Return the keys files found on disk for ``path``, in any shard layout."""
+    root, ext = os.path.splitext(path)
+    paths = glob.glob(f"{glob.escape(root)}.*-of-*{ext}")
+    if os.path.exists(path):
+        paths.append(path)
+    return sorted(paths)
+
+
+def shard_of(key, count):
+    """Return the shard number of ``key``. Stable across processes."""
+    return zlib.crc32(key.encode()) % count
+
+
+class Shard:
+    """One file of a key store and the entries loaded from it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.keys = []
+        self.stamp = None
+        self.format = None
+
+    def load(self):
+        """(Re)load the entries, returning where they were read from."""
+        if not os.path.exists(self.path):
+            write_json_atomic(self.path, {"valid_keys": []})
+        stamp = file_stamp(self.path)
+
+        self.format = detect_format(self.path)
+        keys = self._read_index(stamp)
+        source = "index"
+        if keys is None:
+            keys = read_keys(self.path)
+            source = self.format
+
+        self.keys = keys
+        self.stamp = stamp
+        return source
+
+    def changed(self):
+        """Whether the file was modified since it was loaded or written."""
+        try:
+            return file_stamp(self.path) != self.stamp
+        except FileNotFoundError:
+            return True
+
+    def _read_index(self, stamp):
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            with open(self.index_path, "rb") as f:
+                index = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if (
+            not isinstance(index, dict)
+            or index.get("version") != INDEX_VERSION
+            or tuple(index.get("stamp", ())) != stamp
+        ):
+            return None  # Stale or foreign index, fall back to the JSON file
+        return index["keys"]
+
+    def write_index(self):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            marshal.dump(
+                {"version": INDEX_VERSION, "stamp": self.stamp, "keys": self.keys},
+                f,
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def persist(self):
+        # Keep the on-disk format the file was loaded in
+        if self.format == FORMAT_JSONL:
+            write_jsonl(self.path, self.keys)
+        else:
+            write_json_atomic(self.path, {"valid_keys": self.keys})
+        self.stamp = file_stamp(self.path)
+        if os.path.exists(self.index_path):
+            self.write_index()
+
+
+class KeyStore:
+    """In-memory copy of the keys file, indexed by key string.
+
+    The file stays the source of truth: every change is written back, and
+    the file is re-read when its size or modification time changes, so
+    edits made outside the server are still picked up.
+
+    With ``shards`` > 1 the keys are split by key hash over that many
+    files. A write only rewrites the shards it touched, only changed shards
+    are re-read, and full loads and saves handle the shards in parallel.
+    Use ``python -m keyserver.shards reshard`` to change the shard count.
+
+    If a binary index (``<file>.idx``) exists next to a keys file it is
+    used for fast cold starts and kept up to date on every save.
+    """
+
+    def __init__(self, path, shards=1):
+        self.path = path
+        self.shards = [Shard(shard_path) for shard_path in shard_paths(path, shards)]
+        self.lock = RLock()
+        self.ready = Event()
+        self._by_key = {}
+        self._loaded = False
+        self._next_expiry = None
+        self._listeners = []
+
+    @property
+    def index_path(self):
+        """Binary index of an unsharded store."""
+        return self.shards[0].index_path
+
+    def add_listener(self, listener):
+        """Register a :class:`StoreListener` and bring it up to date."""
+        with self.lock:
+            self._listeners.append(listener)
+            listener.reset(self._entries())
+
+    def _notify(self, event, entry):
+        for listener in self._listeners:
+            listener.on_change(event, entry)
+
+    def _entries(self):
+        return [entry for shard in self.shards for entry in shard.keys]
+
+    def _shard(self, key):
+        return self.shards[shard_of(key, len(self.shards))]
+
+    def _each_shard(self, func, shards):
+        """Run ``func`` on every shard in ``shards``, in parallel if several."""
+        if len(shards) <= 1:
+            return [func(shard) for shard in shards]
+        with ThreadPoolExecutor(max_workers=min(len(shards), 8)) as pool:
+            return list(pool.map(func, shards))
+
+    # Loading
+
+    def warm(self):
+        """Load and index the store, returning startup statistics."""
+        start = time.perf_counter()
+        rss_before = _peak_rss_kb()
+        with self.lock:
+            source = self._load(self.shards)
+            count = len(self._by_key)
+        stats = {
+            "keys": count,
+            "shards": len(self.shards),
+            "source": source,
+            "seconds": time.perf_counter() - start,
+            "peak_rss_growth_kb": None,
+        }
+        if rss_before is not None:
+            stats["peak_rss_growth_kb"] = _peak_rss_kb() - rss_before
+        self.ready.set()
+        return stats
+
+    def _load(self, shards):
+        if not self._loaded and not any(
+            os.path.exists(shard.path) for shard in self.shards
+        ):
+            # Refuse to start empty next to keys stored with another shard count
+            if existing_shard_paths(self.path):
+                raise RuntimeError(
+                    f"The keys are not split into {len(self.shards)} shards, "
+                    f"run: python -m keyserver.shards reshard {len(self.shards)}"
+                )
+        sources = self._each_shard(Shard.load, shards)
+        self._loaded = True
+        self._set_keys()
+        self._expire()
+        return ", ".join(sorted(set(sources)))
+
+    def write_index(self):
+        """Write the binary index for the current contents of the keys files."""
+        with self.lock:
+            self._ensure_loaded()
+            for shard in self.shards:
+                shard.write_index()
+
+    def _ensure_loaded(self, shards=None):
+        """Load the store, or re-read ``shards`` (default all) changed outside."""
+        if not self._loaded:
+            self._load(self.shards)
+            return
+        changed = [shard for shard in shards or self.shards if shard.changed()]
+        if changed:
+            self._load(changed)
+
+    def _set_keys(self):
+        self._by_key = {
+            entry["key"]: entry for shard in self.shards for entry in shard.keys
+        }
+        self._update_next_expiry()
+        for listener in self._listeners:
+            listener.reset(self._entries())
+
+    def _track_expiry(self, entry):
+        expiration_date = entry["expiration_date"]
+        if expiration_date and (
+            self._next_expiry is None or expiration_date < self._next_expiry
+        ):
+            self._next_expiry = expiration_date
+
+    def _update_next_expiry(self):
+        expirations = [
+            entry["expiration_date"]
+            for entry in self._by_key.values()
+            if entry["expiration_date"]
+        ]
+        self._next_expiry = min(expirations) if expirations else None
+
+    def _expire(self):
+        """Drop expired keys. Only scans when the earliest expiry has passed."""
+        if self._next_expiry is None:
+            return
+        current_time = datetime.now().isoformat()
+        if current_time <= self._next_expiry:
+            return
+        touched = []
+        for shard in self.shards:
+            keys = []
+            expired = []
+            for entry in shard.keys:
+                if entry["expiration_date"] and current_time > entry["expiration_date"]:
+                    expired.append(entry)
+                else:
+                    keys.append(entry)
+            if expired:
+                shard.keys = keys
+                touched.append(shard)
+                for entry in expired:
+                    del self._by_key[entry["key"]]
+                    self._notify("expire", entry)
+        self._update_next_expiry()
+        self._persist(touched)
+
+    def refresh(self):
+        """Pick up outside edits and drop keys that have expired."""
+        with self.lock:
+            self._ensure_loaded()
+            self._expire()
+
+    # Reading
+
+    def all(self):
+        """Return a list of all unexpired key entries."""
+        with self.lock:
+            self._ensure_loaded()
+            self._expire()
+            return self._entries()
+
+    def get(self, key):
+        """Return the entry for ``key`` or ``None``."""
+        if not isinstance(key, str):
+            return None  # Missing or malformed keys from requests
+        with self.lock:
+            # Only the shard that can hold the key needs to be current
+            self._ensure_loaded([self._shard(key)])
+            self._expire()
+            return self._by_key.get(key)
+
+    def page(self, cursor=0, limit=100, match=None, max_scan=100000):
+        """Return ``(entries, next_cursor)`` for a scan resumed at ``cursor``.
+
+        The cursor counts stored entries in shard order, so pages are read
+        without copying the store. ``match`` optionally filters entries; at
+        most ``max_scan`` entries are examined per call so the lock is held
+        briefly. ``next_cursor`` is ``None`` at the end. Keys removed during
+        a scan can shift later entries by a position.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            self._expire()
+            results = []
+            position = 0
+            stop = cursor + max_scan
+            for shard in self.shards:
+                end = position + len(shard.keys)
+                for index in range(max(cursor, position), min(end, stop)):
+                    entry = shard.keys[index - position]
+                    if match is None or match(entry):
+                        results.append(entry)
+                        if len(results) == limit:
+                            return results, index + 1
+                position = end
+            return results, (stop if stop < position else None)
+
+    # Writing
+
+    def add(self, *entries):
+        """Add new entries and persist them with a single write per shard."""
+        with self.lock:
+            self._ensure_loaded()
+            touched = {}
+            for entry in entries:
+                shard = self._shard(entry["key"])
+                shard.keys.append(entry)
+                touched[id(shard)] = shard
+                self._by_key[entry["key"]] = entry
+                self._track_expiry(entry)
+                self._notify("add", entry)
+            self._persist(list(touched.values()))
+
+    def update(self, *entries):
+        """Persist in-place changes to ``entries`` and notify listeners."""
+        with self.lock:
+            touched = {}
+            for entry in entries:
+                shard = self._shard(entry["key"])
+                touched[id(shard)] = shard
+                self._track_expiry(entry)
+                self._notify("update", entry)
+            self._persist(list(touched.values()))
+
+    def remove(self, key):
+        """Remove ``key`` and return its entry, or ``None`` if it is unknown."""
+        if not isinstance(key, str):
+            return None
+        with self.lock:
+            shard = self._shard(key)
+            self._ensure_loaded([shard])
+            entry = self._by_key.pop(key, None)
+            if entry is not None:
+                shard.keys.remove(entry)
+                self._notify("remove", entry)
+                self._persist([shard])
+            return entry
+
+    def replace_all(self, keys):
+        with self.lock:
+            for shard in self.shards:
+                shard.keys = []
+            for entry in keys:
+                self._shard(entry["key"]).keys.append(entry)
+            self._loaded = True
+            self._set_keys()
+            self._persist(self.shards)
+
+    def save(self):
+        """Persist arbitrary in-place changes. Listeners are fully reset."""
+        with self.lock:
+            self._set_keys()
+            self._persist(self.shards)
+
+    def _persist(self, shards):
+        self._each_shard(Shard.persist, shards)
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+if __name__ == "__main__":
+    # python -m keyserver.store build-index
+    from .utils import key_store
+
+    if sys.argv[1:] != ["build-index"]:
+        sys.exit("usage: python -m keyserver.store build-index")
+    key_store.warm()
+    key_store.write_index()
+    print(f"Wrote {key_store.index_path} ({len(key_store.all())} keys)")
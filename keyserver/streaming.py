@@ -0,0 +1,359 @@
+"""Incremental readers and writers for the keys and request log files.
+
+Both files may be stored either as the original pretty-printed JSON
+(``{"valid_keys": [...]}`` for keys, ``[...]`` for logs) or as
+line-delimited JSON with one object per line. The readers detect the format
+and yield one entry at a time, so scans, migrations and exports run in
+constant memory regardless of file size.
+
+Convert existing files to line-delimited JSON with the server stopped::
+
+    python -m keyserver.streaming convert keys
+    python -m keyserver.streaming convert logs
+
+The server keeps whichever format it finds when writing.
+"""
+
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from .codec import JSON_INDENT, dumps, loads
+
+CHUNK_SIZE = 64 * 1024
+
+FORMAT_JSON = "json"
+FORMAT_JSONL = "jsonl"
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_NON_WHITESPACE = re.compile(r"[^ \t\r\n]")
+
+
+def detect_format(path):
+    """Return ``"json"`` or ``"jsonl"`` for an existing keys or log file."""
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(256).lstrip(_WHITESPACE)
+    if head.startswith("["):
+        return FORMAT_JSON
+    if head.startswith("{"):
+        # A wrapped keys file starts with its "valid_keys" member
+        if head[1:].lstrip(_WHITESPACE).startswith('"valid_keys"'):
+            return FORMAT_JSON
+        return FORMAT_JSONL
+    return FORMAT_JSON if not head else FORMAT_JSONL
+
+
+def _iter_array_items(f, buffer="", offsets=False):
+    """Yield items of the JSON array starting at the current position of ``f``.
+
+    ``buffer`` holds any text already read from ``f``. Only the unparsed
+    remainder of the current chunk is kept in memory. With ``offsets``,
+    yields ``(item, end)`` pairs where ``end`` counts the characters up to
+    the end of the item, starting from ``buffer``.
+    """
+    pos = 0
+    eof = False
+    consumed = 0
+
+    def skip_whitespace():
+        nonlocal buffer, pos, eof
+        while True:
+            match = _NON_WHITESPACE.search(buffer, pos)
+            if match:
+                pos = match.start()
+                return buffer[pos]
+            if eof:
+                return None
+            refill()
+
+    def refill():
+        nonlocal buffer, pos, eof, consumed
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        consumed += pos
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    if skip_whitespace() != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+
+    expect_item = True
+    while True:
+        char = skip_whitespace()
+        if char is None:
+            raise ValueError("Unterminated JSON array")
+        if char == "]":
+            return
+        if char == ",":
+            if expect_item:
+                raise ValueError("Unexpected ',' in JSON array")
+            pos += 1
+            expect_item = True
+            continue
+        try:
+            item, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            refill()  # Item spans the chunk boundary
+            continue
+        if end == len(buffer) and not eof:
+            refill()  # A scalar may continue in the next chunk
+            continue
+        yield (item, consumed + end) if offsets else item
+        pos = end
+        expect_item = False
+
+
+def _iter_lines(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield loads(line)
+
+
+def iter_logs(path):
+    """Yield request log entries from ``path`` one at a time."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    fmt = detect_format(path)
+    with open(path, "r", encoding="utf-8") as f:
+        if fmt == FORMAT_JSONL:
+            yield from _iter_lines(f)
+        else:
+            yield from _iter_array_items(f)
+
+
+def iter_keys(path):
+    """Yield key entries from ``path`` one at a time."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    fmt = detect_format(path)
+    with open(path, "r", encoding="utf-8") as f:
+        if fmt == FORMAT_JSONL:
+            yield from _iter_lines(f)
+            return
+        buffer = f.read(CHUNK_SIZE).lstrip(_WHITESPACE)
+        if buffer.startswith("["):
+            yield from _iter_array_items(f, buffer)
+            return
+        # {"valid_keys": [ ... ]}
+        while (
+            '"valid_keys"' not in buffer
+            or ":" not in buffer.split('"valid_keys"', 1)[1]
+        ):
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("Keys file has no valid_keys member")
+            buffer += chunk
+        buffer = buffer.split('"valid_keys"', 1)[1].split(":", 1)[1]
+        yield from _iter_array_items(f, buffer)
+
+
+def read_keys(path):
+    """Return all key entries in ``path``, parsed in one pass.
+
+    Faster than :func:`iter_keys` when every entry is kept anyway, at the
+    cost of holding the file's contents in memory while parsing.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return []
+    fmt = detect_format(path)
+    with open(path, "rb") as f:
+        if fmt == FORMAT_JSONL:
+            return [loads(line) for line in f if line.strip()]
+        data = loads(f.read())
+    return data if isinstance(data, list) else data["valid_keys"]
+
+
+def repair_log(path):
+    """Cut a torn tail off the log at ``path``, keeping every complete entry.
+
+    An append interrupted by a crash or a full disk leaves a partial entry
+    at the end of the file. The file is truncated back to the last complete
+    entry (and its array closed again); the bytes cut off are saved next to
+    it in ``<path>.torn-<time>`` so nothing is lost. Returns that path, or
+    ``None`` if nothing had to be cut off.
+    """
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        last = _last_non_whitespace(f, size)
+
+    if detect_format(path) == FORMAT_JSONL:
+        with open(path, "rb") as f:
+            if size == 0 or _byte_at(f, size - 1) == b"\n":
+                return None
+            cut = _last_newline(f, size) + 1  # Keep the complete lines
+        closing = b""
+    else:
+        if last is not None:
+            with open(path, "rb") as f:
+                if _byte_at(f, last) == b"]":
+                    return None
+        # Latin-1 maps every byte to one character, so character offsets
+        # are byte offsets; only the structure matters here
+        with open(path, "r", encoding="latin-1") as f:
+            head = f.read(CHUNK_SIZE)
+            cut = head.find("[") + 1  # No complete entry yet
+            try:
+                for _, end in _iter_array_items(f, head, offsets=True):
+                    cut = end
+            except ValueError:
+                pass  # The torn entry
+        if cut == 0:
+            closing = b"[]"  # Not even the opening bracket was written
+        else:
+            closing = b"\n]" if JSON_INDENT else b"]"
+
+    torn_path = None
+    with open(path, "r+b") as f:
+        if cut < size:
+            torn_path = f"{path}.torn-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}"
+            f.seek(cut)
+            with open(torn_path, "wb") as torn:
+                while chunk := f.read(CHUNK_SIZE):
+                    torn.write(chunk)
+        f.seek(cut)
+        f.write(closing)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+    return torn_path
+
+
+def append_log_entry(path, entry):
+    """Append ``entry`` to the log at ``path``; see :func:`append_log_entries`."""
+    return append_log_entries(path, [entry])
+
+
+def append_log_entries(path, entries):
+    """Append ``entries`` to the log at ``path`` without reading the whole file.
+
+    Line-delimited logs get a new line. Array logs are extended in place by
+    overwriting the closing bracket, producing the same layout as
+    ``codec.dumps(logs)``. A torn tail left by an interrupted append is
+    repaired with :func:`repair_log` first. Returns False if the file is
+    missing or empty and has to be created by the caller.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+
+    if detect_format(path) == FORMAT_JSONL:
+        with open(path, "r+b") as f:
+            end = f.seek(0, os.SEEK_END)
+            if _byte_at(f, end - 1) == b"\n":
+                f.seek(end)
+                f.write(b"".join(dumps(entry, indent=0) + b"\n" for entry in entries))
+                return True
+        repair_log(path)
+        return append_log_entries(path, entries)
+
+    items = [dumps(entry) for entry in entries]
+    if JSON_INDENT:
+        pad = b"\n" + b" " * JSON_INDENT
+        items = [pad + item.replace(b"\n", pad) for item in items]
+    with open(path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        close = _last_non_whitespace(f, end)
+        if close is None or _byte_at(f, close) != b"]":
+            close = None
+    if close is None:
+        repair_log(path)
+        return append_log_entries(path, entries)
+
+    with open(path, "r+b") as f:
+        last = _last_non_whitespace(f, close)
+        # Right after "[" the array is empty, otherwise a separator is needed
+        separator = b"" if _byte_at(f, last) == b"[" else b","
+        f.seek(last + 1)
+        f.write(separator + b",".join(items) + (b"\n]" if JSON_INDENT else b"]"))
+        f.truncate()
+    return True
+
+
+def _byte_at(f, offset):
+    f.seek(offset)
+    return f.read(1)
+
+
+def _last_newline(f, end):
+    """Return the offset of the last newline before ``end``, or -1."""
+    while end > 0:
+        start = max(0, end - 4096)
+        f.seek(start)
+        position = f.read(end - start).rfind(b"\n")
+        if position >= 0:
+            return start + position
+        end = start
+    return -1
+
+
+def _last_non_whitespace(f, end):
+    """Return the offset of the last non-whitespace byte before ``end``."""
+    while end > 0:
+        start = max(0, end - 4096)
+        f.seek(start)
+        chunk = f.read(end - start).rstrip()
+        if chunk:
+            return start + len(chunk) - 1
+        end = start
+    return None
+
+
+def stable_view(f):
+    """Return ``(length, suffix)`` describing a consistent copy of a log file.
+
+    Appends never rewrite the first ``length`` bytes of ``f``, so those
+    bytes followed by ``suffix`` stay valid JSON however many entries are
+    appended afterwards. Call with the log lock held.
+    """
+    size = f.seek(0, os.SEEK_END)
+    last = _last_non_whitespace(f, size)
+    if last is None or _byte_at(f, last) != b"]":
+        return size, b""  # Line-delimited: appends only add bytes at the end
+    # Everything up to the last element (or the opening bracket) is stable
+    last = _last_non_whitespace(f, last)
+    return last + 1, b"\n]"
+
+
+def write_jsonl(path, entries):
+    """Write ``entries`` to ``path`` as line-delimited JSON, atomically."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    count = 0
+    with open(tmp_path, "wb") as f:
+        for entry in entries:
+            f.write(dumps(entry, indent=0) + b"\n")
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def convert_to_jsonl(path, reader):
+    """Convert ``path`` to line-delimited JSON in place, in constant memory."""
+    if os.path.exists(path) and detect_format(path) == FORMAT_JSONL:
+        return None
+    return write_jsonl(path, reader(path))
+
+
+if __name__ == "__main__":
+    from .utils import LOGS_FILE, key_store
+
+    targets = {
+        "keys": ([shard.path for shard in key_store.shards], iter_keys),
+        "logs": ([LOGS_FILE], iter_logs),
+    }
+    if len(sys.argv) != 3 or sys.argv[1] != "convert" or sys.argv[2] not in targets:
+        sys.exit("usage: python -m keyserver.streaming convert keys|logs")
+    paths, reader = targets[sys.argv[2]]
+    for path in paths:
+        converted = convert_to_jsonl(path, reader)
+        if converted is None:
+            print(f"{path} is already line-delimited")
+        else:
+            print(f"Converted {converted} entries in {path} to line-delimited JSON")
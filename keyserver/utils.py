@@ -1,16 +1,57 @@
-import json
 import uuid
+import stat
+import time
 from datetime import datetime, timedelta
 import os
-from flask import request, send_from_directory, abort
+from functools import lru_cache
+from flask import request, abort
 from threading import Lock
+from .store import KeyStore, write_json_atomic
+from .streaming import append_log_entries
+from .analytics import LogRollups, RecentLogs
+from .stats import ProductStats
+from .machine_index import MachineIndex
+from .leases import LeaseSigner, RevocationList
+from .key_format import KeyFormat
+from .auth import load_server_secret
+from .journal import ChangeJournal
+from .static_files import send_static
 
-lock = Lock()
+# Guards the read-modify-write cycle on the request log file.
+logs_lock = Lock()
 ABS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__)))
 KEYS_FILE = ABS_PATH + "/key_storage/keys.json"
-LOGS_FILE = ABS_PATH + "/logs/request_logs.json"
+# Replicas on the same machine as the primary need a log file of their own
+DEFAULT_LOGS_FILE = ABS_PATH + "/logs/request_logs.json"
+LOGS_FILE = os.getenv("KEYSERVER_LOGS_FILE", DEFAULT_LOGS_FILE)
 
+# Number of files the keys are split over, see keyserver/shards.py
+KEY_SHARDS = int(os.getenv("KEY_SHARDS", 1))
+key_store = KeyStore(KEYS_FILE, shards=KEY_SHARDS)
+product_stats = ProductStats()
+key_store.add_listener(product_stats)
+machine_index = MachineIndex()
+key_store.add_listener(machine_index)
+# Numbered change log followed by read replicas
+change_journal = ChangeJournal()
+key_store.add_listener(change_journal)
+lease_revocations = RevocationList(ABS_PATH + "/key_storage/lease_revocations.json")
+_lease_signer = None
+_lease_signer_lock = Lock()
+_key_format = None
+_key_format_lock = Lock()
+# Format of newly generated keys: "uuid" (default) or "signed"
+KEY_FORMAT = os.getenv("KEY_FORMAT", "uuid")
+log_rollups = LogRollups()
+recent_logs = RecentLogs()
+# Guards the read-modify-write cycle on the keys. Re-entrant so routes can
+# hold it across several store calls.
+keys_lock = key_store.lock
 
+
+# Results are cached: the served directories are managed by the admin, and
+# resolving symlinks costs a syscall per path component on every request.
+@lru_cache(maxsize=4096)
 def is_safe_path(basedir, path, follow_symlinks=True):
     """Ensure the requested path is within the allowed directory."""
     # Resolve the absolute path
@@ -31,41 +72,154 @@ def serve_file(directory, filename, as_attachment=False):
     if not is_safe_path(directory, requested_path):
         abort(403)  # Forbidden access
 
-    with lock:
-        if os.path.isfile(requested_path):
-            return send_from_directory(directory, filename, as_attachment=as_attachment)
-        else:
-            abort(404)  # File not found
+    # No lock: files are only read, and a single stat decides what is sent
+    try:
+        st = os.stat(requested_path)
+    except OSError:
+        abort(404)  # File not found
+    if not stat.S_ISREG(st.st_mode):
+        abort(404)
+    return send_static(requested_path, st, as_attachment=as_attachment)
 
 
 def load_keys():
-    if not os.path.exists(KEYS_FILE):
-        with open(KEYS_FILE, "w") as f:
-            json.dump({"valid_keys": []}, f, indent=4)
-    with open(KEYS_FILE, "r") as f:
-        keys = json.load(f)["valid_keys"]
-        return remove_expired_keys(keys)
+    """Return all unexpired keys."""
+    return key_store.all()
+
+
+def save_keys(keys=None):
+    """Replace the stored keys, or persist in-place edits when ``keys`` is None."""
+    if keys is None:
+        key_store.save()
+    else:
+        key_store.replace_all(keys)
+
+
+def update_keys(*entries):
+    """Persist in-place changes to ``entries``."""
+    key_store.update(*entries)
+
+
+def find_key(key):
+    """Return the stored entry for ``key`` or ``None``."""
+    return key_store.get(key)
+
+
+def page_keys(cursor=0, limit=100, match=None):
+    """Return ``(entries, next_cursor)`` for one page of a scan of all keys."""
+    return key_store.page(cursor, limit, match)
+
+
+def add_key(entry):
+    key_store.add(entry)
+
+
+def add_keys(entries):
+    """Add several new entries with a single write to the key store."""
+    key_store.add(*entries)
+
+
+def remove_key(key):
+    """Remove ``key`` and return its entry, or ``None`` if it was not found."""
+    entry = key_store.remove(key)
+    if entry is not None:
+        lease_revocations.revoke(key)
+    return entry
+
+
+def wait_for_changes(since, epoch=None, limit=1000, wait=0):
+    """Return the key changes after ``since``, or ``None`` if they are gone.
+
+    Waits up to ``wait`` seconds for a change. Keys expire lazily, so the
+    store is refreshed every few seconds meanwhile to report expiries too.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        key_store.refresh()
+        remaining = max(0, deadline - time.monotonic())
+        changes = change_journal.changes_since(
+            since, epoch, limit=limit, wait=min(remaining, 5)
+        )
+        if changes != [] or time.monotonic() >= deadline:
+            return changes
 
 
-def save_keys(keys):
-    with open(KEYS_FILE, "w") as f:
-        json.dump({"valid_keys": keys}, f, indent=4)
+def keys_for_machine(machine_id):
+    """Return the entries of all keys activated on ``machine_id``."""
+    with keys_lock:
+        entries = (find_key(key) for key in machine_index.keys_for(machine_id))
+        return [entry for entry in entries if entry is not None]
 
 
-def remove_expired_keys(keys):
-    current_time = datetime.now().isoformat()
-    updated_keys = []
-    for key in keys:
-        if key["expiration_date"] and current_time > key["expiration_date"]:
-            continue  # Skip expired keys
-        updated_keys.append(key)
-    if len(updated_keys) != len(keys):
-        save_keys(updated_keys)
-    return updated_keys
+def release_seats(machine_ids, key=None):
+    """Remove ``machine_ids`` from ``key``, or from every key they are on.
 
+    Returns the updated entries.
+    """
+    with keys_lock:
+        released = {}
+        seats = []
+        for machine_id in machine_ids:
+            keys = [key] if key is not None else machine_index.keys_for(machine_id)
+            for name in keys:
+                entry = find_key(name)
+                if entry is not None and machine_id in entry["machine_ids"]:
+                    entry["machine_ids"].remove(machine_id)
+                    released[name] = entry
+                    seats.append((name, machine_id))
+        if released:
+            update_keys(*released.values())
+        released_at = time.time()
+    # One write of the revocation list, without holding up key requests;
+    # leases issued before the release are still covered
+    if seats:
+        lease_revocations.revoke_many(seats, released_at)
+    return list(released.values())
 
-def generate_key(expiration_days, machine_limit, product_id):
-    key = str(uuid.uuid4())
+
+def get_lease_signer():
+    """Return the lease signer, creating its signing key on first use."""
+    global _lease_signer
+    with _lease_signer_lock:
+        if _lease_signer is None:
+            _lease_signer = LeaseSigner()
+        return _lease_signer
+
+
+def issue_lease(entry, machine_id):
+    """Return the lease fields to add to a successful /key response."""
+    token, expires_at = get_lease_signer().issue(entry, machine_id)
+    return {"lease": token, "lease_expires_at": expires_at}
+
+
+def get_key_format():
+    """Return the signed key format, creating its secret on first use."""
+    global _key_format
+    with _key_format_lock:
+        if _key_format is None:
+            _key_format = KeyFormat(
+                load_server_secret("KEY_CHECK_SECRET", "key_check.key")
+            )
+        return _key_format
+
+
+def generate_keys(
+    count, expiration_days, machine_limit, product_id, key_format=KEY_FORMAT
+):
+    """Return ``count`` new key entries in ``key_format`` ("uuid" or "signed")."""
+    if key_format == "signed":
+        keys = get_key_format().new_keys(product_id, count)
+    else:
+        keys = [str(uuid.uuid4()) for _ in range(count)]
+    return [
+        generate_key(expiration_days, machine_limit, product_id, key=key)
+        for key in keys
+    ]
+
+
+def generate_key(expiration_days, machine_limit, product_id, key=None):
+    if key is None:
+        key = str(uuid.uuid4())
 
     return {
         "key": key,
@@ -81,6 +235,22 @@ def generate_key(expiration_days, machine_limit, product_id):
 def log_request(
     action, key=None, machine_id=None, username=None, product_id=None, log_level="INFO"
 ):
+    log_requests(action, [key], machine_id, username, product_id, log_level)
+
+
+def log_requests(
+    action,
+    keys,
+    machine_id=None,
+    username=None,
+    product_id=None,
+    log_level="INFO",
+    product_ids=None,
+):
+    """Log the same request ``action`` once for each of ``keys``, in one write.
+
+    ``product_ids`` gives each key its own product instead of ``product_id``.
+    """
     # Get the client's IP address
     client_ip = (
         request.headers.get("X-Forwarded-For", request.remote_addr)
@@ -88,28 +258,26 @@ def log_request(
         .strip()
     )
 
-    # Create a log entry
-    log_entry = {
-        "timestamp": datetime.now().isoformat(),
-        "level": log_level,
-        "client": {"ip_address": client_ip, "username": username},
-        "action": action,
-        "details": {"key": key, "product_id": product_id, "machine_id": machine_id},
-    }
-
-    # Ensure the log file exists and load existing logs
-    if os.path.exists(LOGS_FILE):
-        with open(LOGS_FILE, "r") as log_file:
-            try:
-                logs = json.load(log_file)  # Load existing logs
-            except json.JSONDecodeError:
-                logs = []  # Start with an empty list if the file is empty or corrupt
-    else:
-        logs = []  # Start with an empty list if the file does not exist
-
-    # Append the new log entry to the logs list
-    logs.append(log_entry)
+    # Create the log entries
+    timestamp = datetime.now().isoformat()
+    if product_ids is None:
+        product_ids = [product_id] * len(keys)
+    log_entries = [
+        {
+            "timestamp": timestamp,
+            "level": log_level,
+            "client": {"ip_address": client_ip, "username": username},
+            "action": action,
+            "details": {"key": key, "product_id": product_id, "machine_id": machine_id},
+        }
+        for key, product_id in zip(keys, product_ids)
+    ]
 
-    # Write the updated logs back to the file
-    with open(LOGS_FILE, "w") as log_file:
-        json.dump(logs, log_file, indent=4)  # Write the logs as formatted JSON
+    with logs_lock:
+        # Append in place (repairing a torn tail); start a new log if the file
+        # is missing or empty
+        if not append_log_entries(LOGS_FILE, log_entries):
+            write_json_atomic(LOGS_FILE, log_entries)
+        for log_entry in log_entries:
+            log_rollups.add(log_entry)
+            recent_logs.add(log_entry)
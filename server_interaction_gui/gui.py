@@ -1,19 +1,51 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import filedialog
 import customtkinter as ctk
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+
+# Requests run on these worker threads so the window never waits on the server
+WORKERS = 4
+REQUEST_TIMEOUT = 60
+# Rows fetched per page of keys or logs
+PAGE_SIZE = 200
+# Lines written to a console per UI tick, so long results render gradually
+RENDER_BATCH = 100
+POLL_MS = 50
 
 
 class KeyServerGUI(ctk.CTk):
     def __init__(self):
         super().__init__()
         self.title("Key Server")
-        self.geometry("700x500")
+        self.geometry("760x600")
 
         # Username and password for basic authentication
         self.username = "admin"
         self.password = "12345"
         self.server = "http://localhost:5000"
 
+        # One keep-alive session for every request, with the auth set once
+        self.session = requests.Session()
+        self.session.auth = (self.username, self.password)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=WORKERS)
+
+        # Workers hand results back through this queue; only the UI thread
+        # touches widgets
+        self.results = queue.Queue()
+        self.pending_lines = {}
+
+        # Paging state of the search and logs tabs
+        self.search_query = None
+        self.search_cursor = None
+        self.search_results = []
+        self.logs_oldest_seq = None
+        self.logs_latest_seq = None
+
         # Create tabs for different functionalities
         self.tab_view = ctk.CTkTabview(self)
         self.tab_view.pack(expand=True, fill="both")
@@ -21,23 +53,109 @@ class KeyServerGUI(ctk.CTk):
         self.generate_tab = self.tab_view.add("Generate Key")
         self.info_tab = self.tab_view.add("Get Key Info")
         self.edit_tab = self.tab_view.add("Edit Key")
+        self.search_tab = self.tab_view.add("Search Keys")
         self.logs_tab = self.tab_view.add("Request Logs")
         self.update_expiration_tab = self.tab_view.add("Update Expiration")
-        self.delete_tab = self.tab_view.add("Delete Key")  # New tab for deleting keys
+        self.delete_tab = self.tab_view.add("Delete Key")
 
         # Setup each tab
         self.setup_generate_tab()
         self.setup_info_tab()
         self.setup_edit_tab()
+        self.setup_search_tab()
         self.setup_logs_tab()
         self.setup_update_expiration_tab()
-        self.setup_delete_tab()  # Setup for delete tab
+        self.setup_delete_tab()
+
+        self.after(POLL_MS, self.process_results)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        self.destroy()
+
+    # Background requests
+
+    def call(self, method, path, on_success, console, expected=(200,), **kwargs):
+        """Send a request on a worker thread.
+
+        ``on_success`` is called on the UI thread with the decoded JSON body
+        when the status is one of ``expected``; anything else is reported to
+        ``console``.
+        """
+
+        def work():
+            response = self.session.request(
+                method, f"{self.server}{path}", timeout=REQUEST_TIMEOUT, **kwargs
+            )
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            return response.status_code, data, response.text
+
+        def done(result):
+            status, data, text = result
+            if status in expected:
+                on_success(data)
+            else:
+                self.write(console, f"Error: {status} - {text}")
+
+        self.submit(work, done, console)
+
+    def submit(self, work, done, console):
+        """Run ``work`` on a worker thread and ``done`` with its result here."""
+
+        def run():
+            try:
+                self.results.put((done, work(), None))
+            except Exception as e:
+                self.results.put((None, None, (console, e)))
+
+        self.executor.submit(run)
+
+    def process_results(self):
+        try:
+            while True:
+                done, result, error = self.results.get_nowait()
+                if error is not None:
+                    console, e = error
+                    self.write(console, f"Exception: {str(e)}")
+                else:
+                    done(result)
+        except queue.Empty:
+            pass
+        self.render_pending()
+        self.after(POLL_MS, self.process_results)
+
+    # Incremental console output
+
+    def write(self, console, *lines, clear=False):
+        """Queue ``lines`` for ``console``; they are inserted a batch per tick."""
+        if clear:
+            console.delete("1.0", "end")
+            self.pending_lines.pop(console, None)
+        self.pending_lines.setdefault(console, []).extend(lines)
+
+    def render_pending(self):
+        for console, lines in list(self.pending_lines.items()):
+            batch, rest = lines[:RENDER_BATCH], lines[RENDER_BATCH:]
+            console.insert("end", "".join(f"{line}\n" for line in batch))
+            if rest:
+                self.pending_lines[console] = rest
+            else:
+                del self.pending_lines[console]
+
+    def add_entry(self, tab, label):
+        ctk.CTkLabel(tab, text=label).pack(pady=(10, 0))
+        entry = ctk.CTkEntry(tab)
+        entry.pack(pady=(0, 10))
+        return entry
 
     def setup_delete_tab(self):
         # Input for key to delete
-        ctk.CTkLabel(self.delete_tab, text="Key to Delete:").pack(pady=(10, 0))
-        self.key_delete_entry = ctk.CTkEntry(self.delete_tab)
-        self.key_delete_entry.pack(pady=(0, 10))
+        self.key_delete_entry = self.add_entry(self.delete_tab, "Key to Delete:")
 
         # Button to delete key
         ctk.CTkButton(self.delete_tab, text="Delete Key", command=self.delete_key).pack(
@@ -50,39 +168,23 @@ class KeyServerGUI(ctk.CTk):
 
     def delete_key(self):
         key = self.key_delete_entry.get()
-
-        url = f"{self.server}/delete-key?key={key}"
-        auth = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
-        headers = {"Authorization": f"Basic {auth}"}
-
-        try:
-            response = requests.delete(url, headers=headers)
-            if response.status_code == 200:
-                self.console_delete.insert("end", "Key Deleted Successfully\n")
-            else:
-                self.console_delete.insert(
-                    "end", f"Error: {response.status_code} - {response.text}\n"
-                )
-        except Exception as e:
-            self.console_delete.insert("end", f"Exception: {str(e)}\n")
+        self.call(
+            "DELETE",
+            "/delete-key",
+            lambda data: self.write(self.console_delete, "Key Deleted Successfully"),
+            self.console_delete,
+            params={"key": key},
+        )
 
     def setup_generate_tab(self):
         # Input fields for key generation parameters
-        ctk.CTkLabel(self.generate_tab, text="Expiration Days:").pack(pady=(10, 0))
-        self.expiration_entry = ctk.CTkEntry(self.generate_tab)
-        self.expiration_entry.pack(pady=(0, 10))
-
-        ctk.CTkLabel(self.generate_tab, text="Machine Limit:").pack(pady=(10, 0))
-        self.machine_limit_entry = ctk.CTkEntry(self.generate_tab)
-        self.machine_limit_entry.pack(pady=(0, 10))
-
-        ctk.CTkLabel(self.generate_tab, text="Product Name:").pack(
-            pady=(10, 0)
-        )  # Updated label
-        self.product_name_entry = ctk.CTkEntry(self.generate_tab)
-        self.product_name_entry.pack(pady=(0, 10))
+        self.expiration_entry = self.add_entry(self.generate_tab, "Expiration Days:")
+        self.machine_limit_entry = self.add_entry(self.generate_tab, "Machine Limit:")
+        self.product_name_entry = self.add_entry(self.generate_tab, "Product Name:")
+        self.count_entry = self.add_entry(self.generate_tab, "Number of Keys:")
+        self.count_entry.insert(0, "1")
 
-        # Button to generate key
+        # Button to generate keys
         ctk.CTkButton(
             self.generate_tab, text="Generate Key", command=self.generate_key
         ).pack(pady=20)
@@ -93,9 +195,7 @@ class KeyServerGUI(ctk.CTk):
 
     def setup_info_tab(self):
         # Input for key to get information
-        ctk.CTkLabel(self.info_tab, text="Key:").pack(pady=(10, 0))
-        self.key_info_entry = ctk.CTkEntry(self.info_tab)
-        self.key_info_entry.pack(pady=(0, 10))
+        self.key_info_entry = self.add_entry(self.info_tab, "Key:")
 
         # Button to get key info
         ctk.CTkButton(
@@ -108,17 +208,13 @@ class KeyServerGUI(ctk.CTk):
 
     def setup_edit_tab(self):
         # Input fields for editing key info
-        ctk.CTkLabel(self.edit_tab, text="Key:").pack(pady=(10, 0))
-        self.key_edit_entry = ctk.CTkEntry(self.edit_tab)
-        self.key_edit_entry.pack(pady=(0, 10))
-
-        ctk.CTkLabel(self.edit_tab, text="New Expiration Days:").pack(pady=(10, 0))
-        self.new_expiration_entry = ctk.CTkEntry(self.edit_tab)
-        self.new_expiration_entry.pack(pady=(0, 10))
-
-        ctk.CTkLabel(self.edit_tab, text="New Machine Limit:").pack(pady=(10, 0))
-        self.new_machine_limit_entry = ctk.CTkEntry(self.edit_tab)
-        self.new_machine_limit_entry.pack(pady=(0, 10))
+        self.key_edit_entry = self.add_entry(self.edit_tab, "Key:")
+        self.new_expiration_entry = self.add_entry(
+            self.edit_tab, "New Expiration Days:"
+        )
+        self.new_machine_limit_entry = self.add_entry(
+            self.edit_tab, "New Machine Limit:"
+        )
 
         # Button to edit key
         ctk.CTkButton(self.edit_tab, text="Edit Key", command=self.edit_key).pack(
@@ -129,27 +225,81 @@ class KeyServerGUI(ctk.CTk):
         self.console_edit = ctk.CTkTextbox(self.edit_tab, width=500, height=150)
         self.console_edit.pack(pady=(10, 20))
 
+    def setup_search_tab(self):
+        # Filters; all of them are optional
+        filters = ctk.CTkFrame(self.search_tab)
+        filters.pack(pady=(10, 0))
+        self.search_key_entry = self.labeled(filters, "Key contains:", 0, 0)
+        self.search_product_entry = self.labeled(filters, "Product ID:", 0, 2)
+        self.search_machine_entry = self.labeled(filters, "Machine ID:", 1, 0)
+        self.search_activated = ctk.CTkOptionMenu(
+            filters, values=["Any", "Activated", "Not activated"]
+        )
+        self.search_activated.grid(row=1, column=3, padx=5, pady=5)
+
+        buttons = ctk.CTkFrame(self.search_tab, fg_color="transparent")
+        buttons.pack(pady=10)
+        ctk.CTkButton(buttons, text="Search", command=self.search_keys).pack(
+            side="left", padx=5
+        )
+        self.search_next_button = ctk.CTkButton(
+            buttons, text="Next Page", command=self.next_search_page, state="disabled"
+        )
+        self.search_next_button.pack(side="left", padx=5)
+
+        # Bulk edit of every key found so far
+        bulk = ctk.CTkFrame(self.search_tab)
+        bulk.pack(pady=(0, 10))
+        self.bulk_expiration_entry = self.labeled(bulk, "New Expiration Days:", 0, 0)
+        self.bulk_machine_limit_entry = self.labeled(bulk, "New Machine Limit:", 0, 2)
+        ctk.CTkButton(bulk, text="Edit Found Keys", command=self.edit_found_keys).grid(
+            row=1, column=0, columnspan=4, pady=5
+        )
+
+        # Text box for console output
+        self.console_search = ctk.CTkTextbox(self.search_tab, width=700, height=200)
+        self.console_search.pack(pady=(10, 20), expand=True, fill="both")
+
+    def labeled(self, frame, label, row, column):
+        ctk.CTkLabel(frame, text=label).grid(row=row, column=column, padx=5, pady=5)
+        entry = ctk.CTkEntry(frame)
+        entry.grid(row=row, column=column + 1, padx=5, pady=5)
+        return entry
+
     def setup_logs_tab(self):
-        # Button to request logs
+        # Filters for the logs shown
+        filters = ctk.CTkFrame(self.logs_tab)
+        filters.pack(pady=(10, 0))
+        self.logs_action_entry = self.labeled(filters, "Action:", 0, 0)
+        self.logs_product_entry = self.labeled(filters, "Product ID:", 0, 2)
+
+        buttons = ctk.CTkFrame(self.logs_tab, fg_color="transparent")
+        buttons.pack(pady=10)
+        ctk.CTkButton(buttons, text="Get Request Logs", command=self.request_logs).pack(
+            side="left", padx=5
+        )
+        ctk.CTkButton(buttons, text="Older", command=self.older_logs).pack(
+            side="left", padx=5
+        )
+        ctk.CTkButton(buttons, text="Newer", command=self.newer_logs).pack(
+            side="left", padx=5
+        )
         ctk.CTkButton(
-            self.logs_tab, text="Get Request Logs", command=self.request_logs
-        ).pack(pady=20)
+            buttons, text="Download Full Log", command=self.download_logs
+        ).pack(side="left", padx=5)
 
         # Text box for console output
-        self.console_logs = ctk.CTkTextbox(self.logs_tab, width=500, height=250)
-        self.console_logs.pack(pady=(10, 20))
+        self.console_logs = ctk.CTkTextbox(self.logs_tab, width=700, height=250)
+        self.console_logs.pack(pady=(10, 20), expand=True, fill="both")
 
     def setup_update_expiration_tab(self):
         # Input fields for updating expiration
-        ctk.CTkLabel(self.update_expiration_tab, text="Product ID:").pack(pady=(10, 0))
-        self.update_product_id_entry = ctk.CTkEntry(self.update_expiration_tab)
-        self.update_product_id_entry.pack(pady=(0, 10))
-
-        ctk.CTkLabel(self.update_expiration_tab, text="Additional Days:").pack(
-            pady=(10, 0)
+        self.update_product_id_entry = self.add_entry(
+            self.update_expiration_tab, "Product ID:"
+        )
+        self.additional_days_entry = self.add_entry(
+            self.update_expiration_tab, "Additional Days:"
         )
-        self.additional_days_entry = ctk.CTkEntry(self.update_expiration_tab)
-        self.additional_days_entry.pack(pady=(0, 10))
 
         # Button to update expiration
         ctk.CTkButton(
@@ -168,55 +318,64 @@ class KeyServerGUI(ctk.CTk):
         expiration_days = self.expiration_entry.get()
         machine_limit = self.machine_limit_entry.get()
         product_name = self.product_name_entry.get()  # Get dynamic product name
+        count = self.count_entry.get() or "1"
 
         # Validation for input fields
         if (
             not expiration_days.isdigit()
             or not machine_limit.isdigit()
             or not product_name
+            or not count.isdigit()
+            or int(count) < 1
         ):
-            self.console_generate.insert(
-                "end",
-                "Please enter valid expiration days, machine limit, and product name.\n",
+            self.write(
+                self.console_generate,
+                "Please enter valid expiration days, machine limit, product name "
+                "and number of keys.",
             )
             return
 
-        url = f"{self.server}/generate-key?expiration_days={expiration_days}&machine_limit={machine_limit}&product_id={product_name}"
-        auth = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
-        headers = {"Authorization": f"Basic {auth}"}
-
-        try:
-            response = requests.post(url, headers=headers)
-            print(url)
-            if response.status_code == 201:
-                key_info = response.json().get("key", "No key found")
-                self.console_generate.insert("end", f"Key Generated: {key_info}\n")
-            else:
-                self.console_generate.insert(
-                    "end", f"Error: {response.status_code} - {response.text}\n"
-                )
-        except Exception as e:
-            self.console_generate.insert("end", f"Exception: {str(e)}\n")
+        params = {
+            "expiration_days": expiration_days,
+            "machine_limit": machine_limit,
+            "product_id": product_name,
+        }
+        if int(count) == 1:
+            self.call(
+                "POST",
+                "/generate-key",
+                lambda data: self.write(
+                    self.console_generate,
+                    f"Key Generated: {data.get('key', 'No key found')}",
+                ),
+                self.console_generate,
+                expected=(201,),
+                params=params,
+            )
+        else:
+            # One request and one store write for the whole batch
+            self.call(
+                "POST",
+                "/generate-keys",
+                lambda data: self.write(
+                    self.console_generate,
+                    f"{len(data['keys'])} Keys Generated:",
+                    *data["keys"],
+                ),
+                self.console_generate,
+                expected=(201,),
+                params=dict(params, count=count),
+            )
 
     def get_key_info(self):
         key = self.key_info_entry.get()
-        url = f"{self.server}/key-info?key={key}"
-        auth = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
-        headers = {"Authorization": f"Basic {auth}"}
-
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                key_info = response.json()
-                # Prettify the key info output
-                formatted_info = self.format_key_info(key_info)
-                self.console_info.insert("end", f"{formatted_info}\n")
-            else:
-                self.console_info.insert(
-                    "end", f"Error: {response.status_code} - {response.text}\n"
-                )
-        except Exception as e:
-            self.console_info.insert("end", f"Exception: {str(e)}\n")
+        self.call(
+            "GET",
+            "/key-info",
+            lambda data: self.write(self.console_info, self.format_key_info(data)),
+            self.console_info,
+            params={"key": key},
+        )
 
     def format_key_info(self, key_info):
         """Format the key info JSON for better readability."""
@@ -247,76 +406,268 @@ class KeyServerGUI(ctk.CTk):
 
         return formatted_output
 
+    def format_key_row(self, entry):
+        """Format a key entry as one line of search results."""
+        activated = "activated" if entry.get("activated") else "not activated"
+        return (
+            f"{entry['key']}  {entry.get('product_id')}  {activated}  "
+            f"machines {len(entry.get('machine_ids', []))}/{entry.get('machine_limit')}"
+            f"  expires {entry.get('expiration_date') or 'never'}"
+        )
+
+    def format_log_row(self, entry):
+        """Format a request log entry as one line."""
+        client = entry.get("client", {})
+        details = entry.get("details", {})
+        fields = [
+            f"{name}={value}"
+            for name, value in (
+                ("user", client.get("username")),
+                ("ip", client.get("ip_address")),
+                ("key", details.get("key")),
+                ("product", details.get("product_id")),
+                ("machine", details.get("machine_id")),
+            )
+            if value
+        ]
+        return f"{entry['timestamp']} {entry['level']} {entry['action']} " + " ".join(
+            fields
+        )
+
     def edit_key(self):
         key = self.key_edit_entry.get()
         new_expiration_days = self.new_expiration_entry.get()
         new_machine_limit = self.new_machine_limit_entry.get()
 
-        url = f"{self.server}/edit-key"
-        auth = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
-        headers = {"Authorization": f"Basic {auth}", "Content-Type": "application/json"}
+        if not new_expiration_days.isdigit() or not new_machine_limit.isdigit():
+            self.write(
+                self.console_edit,
+                "Please enter valid expiration days and machine limit.",
+            )
+            return
+
         data = {
             "key": key,
             "expiration_days": int(new_expiration_days),
             "machine_limit": int(new_machine_limit),
         }
+        self.call(
+            "PUT",
+            "/edit-key",
+            lambda data: self.write(self.console_edit, "Key Updated Successfully"),
+            self.console_edit,
+            json=data,
+        )
 
-        try:
-            response = requests.put(url, headers=headers, json=data)
-            if response.status_code == 200:
-                self.console_edit.insert("end", "Key Updated Successfully\n")
-            else:
-                self.console_edit.insert(
-                    "end", f"Error: {response.status_code} - {response.text}\n"
-                )
-        except Exception as e:
-            self.console_edit.insert("end", f"Exception: {str(e)}\n")
+    def search_keys(self):
+        """Start a new search from the first page."""
+        params = {"limit": PAGE_SIZE}
+        for name, entry in (
+            ("key", self.search_key_entry),
+            ("product_id", self.search_product_entry),
+            ("machine_id", self.search_machine_entry),
+        ):
+            if entry.get():
+                params[name] = entry.get()
+        activated = self.search_activated.get()
+        if activated != "Any":
+            params["activated"] = "true" if activated == "Activated" else "false"
+
+        self.search_query = params
+        self.search_results = []
+        self.write(self.console_search, clear=True)
+        self.fetch_search_page(0)
+
+    def next_search_page(self):
+        if self.search_cursor is not None:
+            self.fetch_search_page(self.search_cursor)
+
+    def fetch_search_page(self, cursor):
+        self.search_next_button.configure(state="disabled")
+
+        def show(data):
+            self.search_results.extend(entry["key"] for entry in data["keys"])
+            self.search_cursor = data["next_cursor"]
+            self.write(self.console_search, *map(self.format_key_row, data["keys"]))
+            if self.search_cursor is not None:
+                self.search_next_button.configure(state="normal")
+            self.write(
+                self.console_search,
+                f"-- {len(self.search_results)} keys found"
+                + (
+                    ", more on the next page --"
+                    if self.search_cursor is not None
+                    else " --"
+                ),
+            )
+
+        self.call(
+            "GET",
+            "/keys/search",
+            show,
+            self.console_search,
+            params=dict(self.search_query, cursor=cursor),
+        )
+
+    def edit_found_keys(self):
+        """Apply the bulk edit fields to every key found by the search."""
+        expiration_days = self.bulk_expiration_entry.get()
+        machine_limit = self.bulk_machine_limit_entry.get()
+        if not self.search_results:
+            self.write(self.console_search, "Search for the keys to edit first.")
+            return
+        if (expiration_days and not expiration_days.isdigit()) or (
+            machine_limit and not machine_limit.isdigit()
+        ):
+            self.write(
+                self.console_search,
+                "Please enter valid expiration days and machine limit.",
+            )
+            return
+
+        edits = {}
+        if expiration_days:
+            edits["expiration_days"] = int(expiration_days)
+        if machine_limit:
+            edits["machine_limit"] = int(machine_limit)
+        if not edits:
+            self.write(self.console_search, "Nothing to change.")
+            return
+
+        # One request per page of keys, each a single write on the server
+        keys = list(self.search_results)
+        for start in range(0, len(keys), PAGE_SIZE):
+            self.call(
+                "PUT",
+                "/edit-keys",
+                lambda data: self.write(
+                    self.console_search,
+                    f"Updated {data['updated']} keys"
+                    + (
+                        f", {len(data['not_found'])} no longer exist"
+                        if data["not_found"]
+                        else ""
+                    ),
+                ),
+                self.console_search,
+                json=dict(edits, keys=keys[start : start + PAGE_SIZE]),
+            )
+
+    def logs_params(self, **params):
+        params["limit"] = PAGE_SIZE
+        if self.logs_action_entry.get():
+            params["action"] = self.logs_action_entry.get()
+        if self.logs_product_entry.get():
+            params["product_id"] = self.logs_product_entry.get()
+        return params
 
     def request_logs(self):
-        url = f"{self.server}/request-logs"
-        auth = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
-        headers = {"Authorization": f"Basic {auth}"}
+        """Show the latest page of request logs."""
 
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                logs = response.json()
-                self.console_logs.insert("end", f"Request Logs: {logs}\n")
-            else:
-                self.console_logs.insert(
-                    "end", f"Error: {response.status_code} - {response.text}\n"
-                )
-        except Exception as e:
-            self.console_logs.insert("end", f"Exception: {str(e)}\n")
+        def show(data):
+            self.write(self.console_logs, clear=True)
+            self.logs_oldest_seq = None
+            self.show_logs(data, at_end=True)
+
+        self.call(
+            "GET", "/recent-logs", show, self.console_logs, params=self.logs_params()
+        )
+
+    def newer_logs(self):
+        if self.logs_latest_seq is None:
+            return self.request_logs()
+        self.call(
+            "GET",
+            "/recent-logs",
+            lambda data: self.show_logs(data, at_end=True),
+            self.console_logs,
+            params=self.logs_params(since=self.logs_latest_seq),
+        )
+
+    def older_logs(self):
+        if self.logs_oldest_seq is None:
+            return self.request_logs()
+        self.call(
+            "GET",
+            "/recent-logs",
+            lambda data: self.show_logs(data, at_end=False),
+            self.console_logs,
+            params=self.logs_params(before=self.logs_oldest_seq),
+        )
+
+    def show_logs(self, data, at_end):
+        logs = data["logs"]
+        if at_end:
+            self.logs_latest_seq = data["seq"]
+            if self.logs_oldest_seq is None and logs:
+                self.logs_oldest_seq = logs[0]["seq"]
+            self.write(self.console_logs, *map(self.format_log_row, logs))
+        elif logs:
+            # Older pages go above what is shown; a page is at most PAGE_SIZE lines
+            self.logs_oldest_seq = logs[0]["seq"]
+            self.console_logs.insert(
+                "1.0", "".join(f"{self.format_log_row(entry)}\n" for entry in logs)
+            )
+        else:
+            self.write(
+                self.console_logs,
+                "-- No older entries in memory; download the full log for more --",
+            )
+
+    def download_logs(self):
+        """Stream the complete request log to a file."""
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json", initialfile="request_logs.json"
+        )
+        if not path:
+            return
+
+        def work():
+            size = 0
+            # Compressed on the wire and written as it arrives
+            with self.session.get(
+                f"{self.server}/request-logs",
+                headers={"Accept-Encoding": "gzip"},
+                stream=True,
+                timeout=REQUEST_TIMEOUT,
+            ) as response:
+                if response.status_code != 200:
+                    return f"Error: {response.status_code} - {response.text}"
+                with open(path, "wb") as f:
+                    for chunk in response.iter_content(1024 * 1024):
+                        f.write(chunk)
+                        size += len(chunk)
+            return f"Saved {size} bytes of logs to {path}"
+
+        self.write(self.console_logs, f"Downloading the full log to {path}...")
+        self.submit(
+            work,
+            lambda message: self.write(self.console_logs, message),
+            self.console_logs,
+        )
 
     def update_expiration(self):
         product_id = self.update_product_id_entry.get()
         additional_days = self.additional_days_entry.get()
 
         if not product_id or not additional_days.isdigit():
-            self.console_update.insert(
-                "end", "Please enter a valid product ID and number of days.\n"
+            self.write(
+                self.console_update,
+                "Please enter a valid product ID and number of days.",
             )
             return
 
-        url = f"{self.server}/update-expiration"
-        auth = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
-        headers = {"Authorization": f"Basic {auth}", "Content-Type": "application/json"}
         data = {"product_id": product_id, "additional_days": int(additional_days)}
-
-        try:
-            response = requests.put(url, headers=headers, json=data)
-            if response.status_code == 200:
-                self.console_update.insert(
-                    "end",
-                    f"Expiration updated successfully for product '{product_id}'.\n",
-                )
-            else:
-                self.console_update.insert(
-                    "end", f"Error: {response.status_code} - {response.text}\n"
-                )
-        except Exception as e:
-            self.console_update.insert("end", f"Exception: {str(e)}\n")
+        self.call(
+            "PUT",
+            "/update-expiration",
+            lambda data: self.write(
+                self.console_update,
+                f"Expiration updated successfully for product '{product_id}'.",
+            ),
+            self.console_update,
+            json=data,
+        )
 
 
 if __name__ == "__main__":
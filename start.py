@@ -1,5 +1,17 @@
+import os
 from keyserver import app
+from keyserver.server import start
 from waitress import serve
 
 if __name__ == "__main__":
-    serve(app, host="0.0.0.0", port=5000)  # Change the port if needed
+    start()
+    # Set PORT to run a replica next to the primary on the same machine.
+    # Event streams and long polls each hold one of the THREADS while they
+    # wait; at most MAX_EVENT_STREAMS (THREADS / 2 by default) do at once,
+    # so raise THREADS along with it when more clients follow the server.
+    serve(
+        app,
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 5000)),
+        threads=int(os.getenv("THREADS", 8)),
+    )
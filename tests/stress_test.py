@@ -0,0 +1,492 @@
+"""Concurrency stress test for the key server.
+
+Fires parallel key generations, activations and edits at a live server and
+then checks that the stored data is still consistent:
+
+* no key has more machine IDs than its ``machine_limit``
+* every generated key is present in the keys file
+* every successful activation is recorded on its key
+* the per-product counters match the stored keys
+* the request log still parses
+
+It runs as part of the test suite against an in-process waitress server,
+or standalone against any running server, e.g.::
+
+    python tests/stress_test.py --url http://localhost:5000 --keys 50 --machines 20
+
+Throughput for each phase is printed so different storage setups can be
+compared for both speed and correctness.
+
+The suite also starts a read replica (``start.py`` with
+``KEYSERVER_PRIMARY_URL`` set) in a separate process and checks that it
+forwards writes and serves validations once they have replicated.
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+STRESS_PRODUCT_ID = "StressTest"
+
+
+class StressClient:
+    """Minimal HTTP client built on urllib so the harness has no extra deps."""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip("/")
+        token = base64.b64encode(f"{username}:{password}".encode()).decode()
+        self.auth_header = f"Basic {token}"
+
+    def request(self, method, path, params=None, body=None, auth=True):
+        url = self.base_url + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        data = None
+        req = urllib.request.Request(url, method=method)
+        if auth:
+            req.add_header("Authorization", self.auth_header)
+        if body is not None:
+            data = json.dumps(body).encode()
+            req.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(req, data=data, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def run_phase(name, func, jobs, workers):
+    """Run ``func`` over ``jobs`` in a thread pool and report throughput."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(func, jobs))
+    elapsed = time.perf_counter() - start
+    rate = len(jobs) / elapsed if elapsed else float("inf")
+    print(f"{name}: {len(jobs)} requests in {elapsed:.2f}s ({rate:.1f} req/s)")
+    return results
+
+
+def parse_export(body, member=None):
+    """Parse a /keys or /request-logs download in either storage format."""
+    text = body.decode()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # Line-delimited JSON, one entry per line
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data[member] if member and isinstance(data, dict) else data
+
+
+def run_stress(client, num_keys=10, machines_per_key=8, machine_limit=3, workers=16):
+    """Run the stress scenario and return a list of invariant violations."""
+    errors = []
+
+    # Phase 1: concurrent generation
+    def generate(_):
+        status, body = client.request(
+            "POST",
+            "/generate-key",
+            params={
+                "expiration_days": 30,
+                "machine_limit": machine_limit,
+                "product_id": STRESS_PRODUCT_ID,
+            },
+        )
+        if status != 201:
+            errors.append(f"generate-key returned {status}: {body[:200]!r}")
+            return None
+        return json.loads(body)["key"]
+
+    generated = run_phase("generate", generate, list(range(num_keys)), workers)
+    generated = [key for key in generated if key]
+
+    # Phase 2: concurrent activations, more machines than seats, interleaved
+    # with edits that rewrite the same keys.
+    def activate(job):
+        key, machine_id = job
+        status, body = client.request(
+            "POST", "/key", params={"key": key, "machine_id": machine_id}
+        )
+        return key, machine_id, status, json.loads(body).get("status")
+
+    def edit(key):
+        status, body = client.request(
+            "PUT", "/edit-key", body={"key": key, "machine_limit": machine_limit}
+        )
+        if status != 200:
+            errors.append(f"edit-key returned {status}: {body[:200]!r}")
+        return status
+
+    activation_jobs = [
+        (key, f"stress-machine-{i}")
+        for i in range(machines_per_key)
+        for key in generated
+    ]
+    edit_jobs = generated * 2
+
+    edit_thread = threading.Thread(
+        target=run_phase, args=("edit", edit, edit_jobs, max(1, workers // 4))
+    )
+    edit_thread.start()
+    activations = run_phase("activate", activate, activation_jobs, workers)
+    edit_thread.join()
+
+    activated = {}
+    for key, machine_id, status, result in activations:
+        if result == "activated":
+            activated.setdefault(key, set()).add(machine_id)
+        elif result != "limit_exceeded":
+            errors.append(f"unexpected activation result {status} {result}")
+
+    # Phase 3: re-validate every activated pair concurrently
+    validate_jobs = [
+        (key, machine_id)
+        for key, machines in activated.items()
+        for machine_id in machines
+    ]
+    validations = run_phase("validate", activate, validate_jobs, workers)
+    for key, machine_id, status, result in validations:
+        if result != "valid":
+            errors.append(f"{key}/{machine_id} did not validate: {result}")
+
+    # Invariants on the stored keys
+    status, body = client.request("GET", "/keys")
+    if status != 200:
+        errors.append(f"/keys returned {status}")
+        return errors
+    stored = {entry["key"]: entry for entry in parse_export(body, "valid_keys")}
+
+    for key in generated:
+        entry = stored.get(key)
+        if entry is None:
+            errors.append(f"generated key {key} was lost")
+            continue
+        machine_ids = entry["machine_ids"]
+        if len(machine_ids) > entry["machine_limit"]:
+            errors.append(f"{key} exceeds machine_limit: {machine_ids}")
+        if len(set(machine_ids)) != len(machine_ids):
+            errors.append(f"{key} has duplicate machine ids: {machine_ids}")
+        if set(machine_ids) != activated.get(key, set()):
+            errors.append(
+                f"{key} activations lost: stored {sorted(machine_ids)}, "
+                f"acknowledged {sorted(activated.get(key, set()))}"
+            )
+
+    # Incrementally maintained counters must agree with the stored keys
+    status, body = client.request(
+        "GET", "/product-stats", params={"product_id": STRESS_PRODUCT_ID}
+    )
+    if status == 200:
+        counters = json.loads(body)["products"].get(STRESS_PRODUCT_ID, {})
+        product_keys = [
+            e for e in stored.values() if e["product_id"] == STRESS_PRODUCT_ID
+        ]
+        expected = {
+            "total_keys": len(product_keys),
+            "seats_used": sum(len(e["machine_ids"]) for e in product_keys),
+        }
+        for name, value in expected.items():
+            if counters.get(name) != value:
+                errors.append(
+                    f"product stats {name} is {counters.get(name)}, expected {value}"
+                )
+
+    # The request log must still parse
+    status, body = client.request("GET", "/request-logs")
+    if status != 200:
+        errors.append(f"/request-logs returned {status}")
+    else:
+        try:
+            parse_export(body)
+        except ValueError as e:
+            errors.append(f"request log is not valid JSON: {e}")
+
+    return errors
+
+
+def cleanup_stress_keys():
+    """Remove keys created by the stress test from the local keys file."""
+    from keyserver.utils import load_keys, save_keys, keys_lock
+
+    with keys_lock:
+        keys = load_keys()
+        save_keys([k for k in keys if k.get("product_id") != STRESS_PRODUCT_ID])
+
+
+def preserve_files(test):
+    """Restore the keys file and request log byte for byte after ``test``.
+
+    The in-process server writes to the real files; restoring them keeps
+    the working tree unchanged by a test run.
+    """
+    from keyserver.utils import KEYS_FILE, LOGS_FILE
+
+    for path in (KEYS_FILE, LOGS_FILE):
+        with open(path, "rb") as f:
+            test.addCleanup(restore_file, path, f.read())
+
+
+def restore_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def start_in_process_server(app):
+    """Serve ``app`` with waitress on a free port; return ``(url, stop)``."""
+    from waitress import wasyncore
+    from waitress.server import create_server
+
+    socket_map = {}
+    server = create_server(app, map=socket_map, host="127.0.0.1", port=0, threads=16)
+    stopping = threading.Event()
+
+    def serve():
+        while not stopping.is_set():
+            wasyncore.loop(timeout=0.05, map=socket_map, count=1)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+
+    def stop():
+        stopping.set()
+        thread.join()
+        server.close()
+
+    return f"http://127.0.0.1:{server.effective_port}", stop
+
+
+class ConcurrencyStressTest(unittest.TestCase):
+    """Runs a small stress scenario against an in-process waitress server."""
+
+    def setUp(self):
+        from keyserver import app
+        from keyserver.server import start
+
+        start()
+        preserve_files(self)
+        url, self.stop_server = start_in_process_server(app)
+        self.client = StressClient(url, "admin", os.getenv("ADMIN_PASSWORD"))
+
+    def tearDown(self):
+        self.stop_server()
+        cleanup_stress_keys()
+
+    def test_concurrent_activation_invariants(self):
+        errors = run_stress(self.client, num_keys=6, machines_per_key=6)
+        self.assertEqual(errors, [])
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.05)
+
+
+class ReplicationTest(unittest.TestCase):
+    """Runs a replica process against an in-process primary."""
+
+    def setUp(self):
+        from keyserver import app
+
+        preserve_files(self)
+        primary_url, self.stop_server = start_in_process_server(app)
+        self.primary = StressClient(primary_url, "admin", os.getenv("ADMIN_PASSWORD"))
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        self.tmp_dir = tempfile.mkdtemp()
+        self.replica_logs = os.path.join(self.tmp_dir, "replica_logs.json")
+        env = dict(
+            os.environ,
+            PORT=str(port),
+            KEYSERVER_PRIMARY_URL=primary_url,
+            KEYSERVER_LOGS_FILE=self.replica_logs,
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, "start.py"],
+            cwd=os.path.join(os.path.dirname(__file__), ".."),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.replica = StressClient(
+            f"http://127.0.0.1:{port}", "admin", os.getenv("ADMIN_PASSWORD")
+        )
+
+        def replica_ready():
+            try:
+                return self.replica.request("GET", "/readyz", auth=False)[0] == 200
+            except OSError:
+                return False
+
+        wait_for(replica_ready)
+
+    def tearDown(self):
+        self.process.terminate()
+        self.process.wait()
+        self.stop_server()
+        shutil.rmtree(self.tmp_dir)
+        cleanup_stress_keys()
+
+    def wait_for_sync(self):
+        def in_sync():
+            primary = json.loads(self.primary.request("GET", "/replication/status")[1])
+            status = json.loads(self.replica.request("GET", "/replication/status")[1])
+            return status["applied_seq"] == primary["seq"]
+
+        wait_for(in_sync)
+
+    def activate(self, key, machine_id):
+        status, body = self.replica.request(
+            "POST", "/key", params={"key": key, "machine_id": machine_id}
+        )
+        return json.loads(body)["status"]
+
+    def test_replica_serves_validations_and_forwards_writes(self):
+        # Writes are forwarded to the primary
+        status, body = self.replica.request(
+            "POST",
+            "/generate-key",
+            params={"product_id": STRESS_PRODUCT_ID, "machine_limit": 2},
+        )
+        self.assertEqual(status, 201)
+        key = json.loads(body)["key"]
+        self.assertEqual(self.activate(key, "machine-1"), "activated")
+
+        # Once replicated, validations are answered by the replica itself
+        self.wait_for_sync()
+        self.assertEqual(self.activate(key, "machine-1"), "valid")
+        with open(self.replica_logs) as f:
+            self.assertIn(key, f.read())
+        status = json.loads(self.replica.request("GET", "/replication/status")[1])
+        self.assertEqual(status["lag_changes"], 0)
+
+        # Removals reach the replica through the change stream
+        status, _ = self.replica.request("DELETE", "/delete-key", params={"key": key})
+        self.assertEqual(status, 200)
+        self.wait_for_sync()
+        self.assertEqual(self.activate(key, "machine-1"), "invalid")
+
+    def test_replica_logs_its_own_validations(self):
+        status, body = self.primary.request(
+            "POST",
+            "/generate-key",
+            params={"product_id": STRESS_PRODUCT_ID, "machine_limit": 1},
+        )
+        key = json.loads(body)["key"]
+        self.assertEqual(self.activate(key, "machine-1"), "activated")
+        self.wait_for_sync()
+        self.assertEqual(self.activate(key, "machine-1"), "valid")
+
+        # The replica reports on the validations it answered itself
+        def replica_stats():
+            status, body = self.replica.request(
+                "GET",
+                "/log-stats",
+                params={"group_by": "action", "product_id": STRESS_PRODUCT_ID},
+            )
+            return status == 200 and json.loads(body)["results"]
+
+        wait_for(replica_stats)
+        results = replica_stats()
+        self.assertEqual(results, [{"action": "validate_key", "count": 1}])
+        status, body = self.replica.request("GET", "/recent-logs", params={"limit": 1})
+        self.assertEqual(json.loads(body)["logs"][0]["details"]["key"], key)
+
+        # Long polls are redirected to the primary, exports relayed from it
+        url = urllib.parse.urlsplit(self.replica.base_url)
+        connection = http.client.HTTPConnection(url.netloc, timeout=10)
+        connection.request(
+            "GET",
+            "/changes?since=0&wait=5",
+            headers={"Authorization": self.replica.auth_header},
+        )
+        response = connection.getresponse()
+        self.assertEqual(response.status, 307)
+        self.assertTrue(
+            response.getheader("Location").startswith(self.primary.base_url)
+        )
+        connection.close()
+        self.assertEqual(
+            self.replica.request("GET", "/keys"), self.primary.request("GET", "/keys")
+        )
+
+    def test_replica_forwards_lease_requests(self):
+        status, body = self.primary.request(
+            "POST",
+            "/generate-key",
+            params={"product_id": STRESS_PRODUCT_ID, "machine_limit": 1},
+        )
+        key = json.loads(body)["key"]
+        self.assertEqual(self.activate(key, "machine-1"), "activated")
+        self.wait_for_sync()
+        self.assertEqual(self.activate(key, "machine-1"), "valid")
+        with open(self.replica_logs) as f:
+            logged = f.read()
+
+        # Without a shared lease key the primary signs the lease
+        status, body = self.replica.request(
+            "POST",
+            "/key",
+            params={"key": key, "machine_id": "machine-1", "lease": "true"},
+        )
+        self.assertEqual(status, 200)
+        lease = json.loads(body)["lease"]
+        with open(self.replica_logs) as f:
+            self.assertEqual(f.read(), logged)
+        status, body = self.primary.request(
+            "POST", "/verify-lease", params={"lease": lease}
+        )
+        self.assertEqual(json.loads(body)["status"], "valid")
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv("credentials.env")
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default=os.getenv("ADMIN_PASSWORD"))
+    parser.add_argument("--keys", type=int, default=50)
+    parser.add_argument("--machines", type=int, default=10)
+    parser.add_argument("--machine-limit", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    client = StressClient(args.url, args.username, args.password)
+    errors = run_stress(
+        client,
+        num_keys=args.keys,
+        machines_per_key=args.machines,
+        machine_limit=args.machine_limit,
+        workers=args.workers,
+    )
+    for error in errors:
+        print(f"FAIL: {error}")
+    print("OK" if not errors else f"{len(errors)} invariant violation(s)")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,40 @@
 import unittest
+import base64
+import gzip
+import importlib.util
+import io
 import json
 import os
+import shutil
 import sys
+import tarfile
+import tempfile
 from datetime import datetime, timedelta
+from threading import BoundedSemaphore
+from unittest.mock import patch
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from keyserver import app
-from keyserver.utils import KEYS_FILE, ABS_PATH
+from keyserver import app, codec
+from keyserver.server import warm_up
+from keyserver.leases import LeaseSigner
+from keyserver.shards import reshard
+from keyserver import snapshots
+from keyserver.snapshots import restore_snapshot
+from keyserver.store import KeyStore, existing_shard_paths, shard_paths
+from keyserver.store import write_json_atomic
+from keyserver.utils import get_key_format, get_lease_signer, update_keys
+from client.lease_verifier import LeaseError, verify_lease
+from keyserver.utils import KEYS_FILE, ABS_PATH, find_key, key_store
+from keyserver.streaming import (
+    append_log_entries,
+    append_log_entry,
+    convert_to_jsonl,
+    detect_format,
+    iter_keys,
+    iter_logs,
+    repair_log,
+    stable_view,
+)
 
 
 class KeyManagementTest(unittest.TestCase):
@@ -85,6 +113,18 @@ class KeyManagementTest(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json["status"], "activated")
 
+    def test_missing_or_malformed_key(self):
+        """Test that requests without a usable key are rejected, not crashed."""
+        response = self.app.post("/key?machine_id=machine-001")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["status"], "invalid")
+        response = self.app.get("/recent-logs?limit=1", auth=self.admin_auth)
+        self.assertEqual(response.json["logs"][0]["action"], "invalid_key_attempt")
+
+        response = self.app.put("/edit-keys", json={"keys": [1]}, auth=self.admin_auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["not_found"], [1])
+
     def test_update_expiration(self):
         """Test updating expiration for all keys of a product ID."""
         response = self.app.put(
@@ -119,6 +159,742 @@ class KeyManagementTest(unittest.TestCase):
         self.assertEqual(response.status_code, 403)
         self.assertEqual(response.json["status"], "forbidden")
 
+    def test_readiness(self):
+        """Test the liveness and readiness probes once the server is warm."""
+        warm_up()
+        self.assertEqual(self.app.get("/healthz").status_code, 200)
+        response = self.app.get("/readyz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["status"], "ready")
+
+    def test_store_picks_up_external_edits(self):
+        """Test that keys written directly to keys.json are served."""
+        self.assertIsNotNone(find_key("TEST-1234-5678"))
+        with open(KEYS_FILE, "w") as f:
+            json.dump({"valid_keys": []}, f, indent=4, sort_keys=True)
+        self.assertIsNone(find_key("TEST-1234-5678"))
+
+    def test_binary_index(self):
+        """Test that the binary index is used and kept fresh on writes."""
+        try:
+            key_store.write_index()
+            self.assertEqual(key_store.warm()["source"], "index")
+            self.app.post(
+                "/key?key=TEST-1234-5678&machine_id=machine-001",
+                auth=self.billing_auth,
+            )
+            stats = key_store.warm()
+            self.assertEqual(stats["source"], "index")
+            self.assertEqual(find_key("TEST-1234-5678")["machine_ids"], ["machine-001"])
+        finally:
+            os.remove(key_store.index_path)
+
+    def test_log_stats(self):
+        """Test aggregated log counts by action and product."""
+        warm_up()
+
+        def activations():
+            response = self.app.get(
+                f"/log-stats?group_by=product_id&bucket=day&action=activate_key"
+                f"&product_id={self.test_product_id}",
+                auth=self.admin_auth,
+            )
+            self.assertEqual(response.status_code, 200)
+            return sum(row["count"] for row in response.json["results"])
+
+        before = activations()
+        self.app.post(
+            "/key?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.billing_auth,
+        )
+        self.assertEqual(activations(), before + 1)
+
+        response = self.app.get("/log-stats?group_by=nope", auth=self.admin_auth)
+        self.assertEqual(response.status_code, 400)
+
+    def test_product_stats(self):
+        """Test per-product counters across generate, activate and delete."""
+
+        def stats():
+            response = self.app.get(
+                f"/product-stats?product_id={self.test_product_id}&expiring_within_days=40",
+                auth=self.admin_auth,
+            )
+            self.assertEqual(response.status_code, 200)
+            return response.json["products"][self.test_product_id]
+
+        self.assertEqual(stats()["total_keys"], 1)
+        self.app.post(
+            f"/generate-key?expiration_days=10&machine_limit=2&product_id={self.test_product_id}",
+            auth=self.admin_auth,
+        )
+        self.app.post(
+            "/key?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.billing_auth,
+        )
+        result = stats()
+        self.assertEqual(result["total_keys"], 2)
+        self.assertEqual(result["activated_keys"], 1)
+        self.assertEqual(result["seats_used"], 1)
+        self.assertEqual(result["seat_limit"], 5)
+        self.assertEqual(result["expiring_soon"], 1)
+
+        self.app.delete("/delete-key?key=TEST-1234-5678", auth=self.admin_auth)
+        result = stats()
+        self.assertEqual(result["total_keys"], 1)
+        self.assertEqual(result["seats_used"], 0)
+
+        response = self.app.get(
+            "/product-stats?expiring_within_days=999999999", auth=self.admin_auth
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_machine_lookup_and_release(self):
+        """Test finding keys by machine ID and releasing its seat."""
+        self.app.post(
+            "/key?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.billing_auth,
+        )
+        response = self.app.get(
+            "/machine-keys?machine_id=machine-001", auth=self.admin_auth
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [entry["key"] for entry in response.json["keys"]], ["TEST-1234-5678"]
+        )
+
+        response = self.app.delete(
+            "/release-seat?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.admin_auth,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(find_key("TEST-1234-5678")["machine_ids"], [])
+        response = self.app.get(
+            "/machine-keys?machine_id=machine-001", auth=self.admin_auth
+        )
+        self.assertEqual(response.json["keys"], [])
+
+        # Bulk release by machine only
+        other_key = self.app.post(
+            f"/generate-key?product_id={self.test_product_id}",
+            auth=self.admin_auth,
+        ).json["key"]
+        for key, machine_id in (
+            ("TEST-1234-5678", "machine-002"),
+            ("TEST-1234-5678", "machine-003"),
+            (other_key, "machine-002"),
+        ):
+            self.app.post(
+                f"/key?key={key}&machine_id={machine_id}", auth=self.billing_auth
+            )
+        with patch(
+            "keyserver.leases.write_json_atomic", wraps=write_json_atomic
+        ) as write, patch(
+            "keyserver.utils.append_log_entries", wraps=append_log_entries
+        ) as append:
+            response = self.app.delete(
+                "/release-seat?machine_id=machine-002&machine_id=machine-003",
+                auth=self.admin_auth,
+            )
+        # All seats are revoked with a single write of the revocation list
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(
+            sorted(item["mid"] for item in write.call_args.args[1][-3:]),
+            ["machine-002", "machine-002", "machine-003"],
+        )
+        self.assertEqual(
+            sorted(response.json["keys"]), sorted(["TEST-1234-5678", other_key])
+        )
+        self.assertEqual(find_key("TEST-1234-5678")["machine_ids"], [])
+        # And logged with a single append
+        self.assertEqual(append.call_count, 1)
+        self.assertEqual(
+            sorted(entry["details"]["key"] for entry in append.call_args.args[1]),
+            sorted(["TEST-1234-5678", other_key]),
+        )
+
+    def test_lease_issue_verify_and_revoke(self):
+        """Test a lease from /key verifies until its seat is released."""
+        response = self.app.post(
+            "/key?key=TEST-1234-5678&machine_id=machine-001&lease=true",
+            auth=self.billing_auth,
+        )
+        self.assertEqual(response.status_code, 200)
+        lease = response.json["lease"]
+
+        response = self.app.post(f"/verify-lease?lease={lease}")
+        self.assertEqual(response.json["status"], "valid")
+        self.assertEqual(response.json["machine_id"], "machine-001")
+
+        # Offline check with the client-side verifier and the public key
+        public_key = None
+        if get_lease_signer().algorithm == "EdDSA":
+            public_key = self.app.get("/lease-public-key").json["public_key"]
+            payload = verify_lease(lease, public_key, machine_id="machine-001")
+            self.assertEqual(payload["key"], "TEST-1234-5678")
+            body, signature = lease.split(".")
+            flipped = ("B" if signature[0] == "A" else "A") + signature[1:]
+            with self.assertRaises(LeaseError):
+                verify_lease(f"{body}.{flipped}", public_key)
+
+        self.app.delete(
+            "/release-seat?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.admin_auth,
+        )
+        response = self.app.post(f"/verify-lease?lease={lease}")
+        self.assertEqual(response.json["status"], "revoked")
+        if public_key is not None:
+            revocations = self.app.get("/lease-revocations").json["revoked"]
+            with self.assertRaises(LeaseError) as context:
+                verify_lease(lease, public_key, revocations=revocations)
+            self.assertEqual(context.exception.status, "revoked")
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("cryptography"), "cryptography is not installed"
+    )
+    def test_ed25519_lease(self):
+        """Test Ed25519 leases verify offline with only the public key."""
+        signer = LeaseSigner(algorithm="EdDSA")
+        token, _ = signer.issue(self.test_key, "machine-001")
+        public_key = base64.b64encode(signer.public_key).decode()
+        payload = verify_lease(token, public_key)
+        self.assertEqual(payload["pid"], self.test_product_id)
+
+        # HMAC leases cannot be checked without the server secret
+        token, _ = LeaseSigner(algorithm="HS256").issue(self.test_key, "machine-001")
+        with self.assertRaises(LeaseError):
+            verify_lease(token, public_key)
+
+    def test_signed_keys(self):
+        """Test bulk generation of signed keys and rejection of forgeries."""
+        with patch(
+            "keyserver.utils.append_log_entries", wraps=append_log_entries
+        ) as append:
+            response = self.app.post(
+                f"/generate-keys?count=5&machine_limit=1&key_format=signed"
+                f"&product_id={self.test_product_id}",
+                auth=self.admin_auth,
+            )
+        self.assertEqual(response.status_code, 201)
+        keys = response.json["keys"]
+        self.assertEqual(len(set(keys)), 5)
+        # Every key is logged, with a single append for the batch
+        self.assertEqual(append.call_count, 1)
+        self.assertEqual(
+            [entry["details"]["key"] for entry in append.call_args.args[1]], keys
+        )
+        for key in keys:
+            self.assertTrue(get_key_format().verify(key, self.test_product_id))
+
+        response = self.app.post(f"/key?key={keys[0]}&machine_id=machine-001")
+        self.assertEqual(response.json["status"], "activated")
+
+        # A forged check digit is rejected without a store lookup
+        forged = keys[1][:-1] + ("A" if keys[1][-1] != "A" else "B")
+        with patch("keyserver.routes.find_key") as find_key_mock:
+            response = self.app.post(f"/key?key={forged}&machine_id=machine-001")
+        self.assertEqual(response.json["status"], "invalid")
+        find_key_mock.assert_not_called()
+
+    def test_conditional_and_compressed_exports(self):
+        """Test ETag revalidation, byte ranges and gzip on /keys."""
+        response = self.app.get("/keys", auth=self.admin_auth)
+        etag = response.headers["ETag"]
+        body = response.data
+
+        response = self.app.get(
+            "/keys", auth=self.admin_auth, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.app.get(
+            "/keys", auth=self.admin_auth, headers={"Range": "bytes=0-9"}
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, body[:10])
+
+        response = self.app.get(
+            "/keys", auth=self.admin_auth, headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.data), body)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        # Any write invalidates both the ETag and the compressed copy
+        self.app.post(
+            "/key?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.billing_auth,
+        )
+        response = self.app.get(
+            "/keys",
+            auth=self.admin_auth,
+            headers={"If-None-Match": etag, "Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"machine-001", gzip.decompress(response.data))
+
+    def test_request_logs_polling(self):
+        """Test that polling an unchanged log with its ETag gets a 304."""
+        for headers in ({}, {"Accept-Encoding": "gzip"}):
+            response = self.app.get(
+                "/request-logs", auth=self.admin_auth, headers=headers
+            )
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers["ETag"]
+            body = response.data
+            if headers:
+                body = gzip.decompress(body)
+            # The download already contains its own retrieval entry
+            self.assertEqual(json.loads(body)[-1]["action"], "retrieve_request_logs")
+
+            with patch("keyserver.exports.compressed_variant") as compress:
+                for _ in range(2):
+                    response = self.app.get(
+                        "/request-logs",
+                        auth=self.admin_auth,
+                        headers=dict(headers, **{"If-None-Match": etag}),
+                    )
+                    self.assertEqual(response.status_code, 304)
+            compress.assert_not_called()
+
+        # New entries change the ETag
+        self.app.post("/key?key=UNKNOWN&machine_id=machine-001")
+        response = self.app.get(
+            "/request-logs",
+            auth=self.admin_auth,
+            headers={"If-None-Match": etag, "Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_static_files(self):
+        """Test cached validation files with ranges, ETags and invalidation."""
+        url = "/.well-known/pki-validation/test_file.txt"
+        response = self.app.get(url)
+        self.assertEqual(response.data, b"This is a test file for validation.")
+        etag = response.headers["ETag"]
+
+        response = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.app.get(url, headers={"Range": "bytes=10-13"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b"test")
+
+        # A changed file is not served from the cache
+        with open(self.test_file_path, "w") as test_file:
+            test_file.write("Replaced token.")
+        self.assertEqual(self.app.get(url).data, b"Replaced token.")
+
+        self.assertEqual(self.app.get("/downloads/missing.bin").status_code, 404)
+        response = self.app.get("/.well-known/pki-validation/../../server.py")
+        self.assertIn(response.status_code, (403, 404))
+
+    def test_replication_changes(self):
+        """Test the snapshot and change stream followed by replicas."""
+        response = self.app.get("/replication/snapshot", auth=self.admin_auth)
+        snapshot = response.get_json()
+        self.assertEqual([k["key"] for k in snapshot["keys"]], ["TEST-1234-5678"])
+
+        self.app.post(
+            "/key?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.billing_auth,
+        )
+        response = self.app.get(
+            f"/replication/changes?since={snapshot['seq']}&epoch={snapshot['epoch']}",
+            auth=self.admin_auth,
+        )
+        (change,) = response.get_json()["changes"]
+        self.assertEqual(change["event"], "update")
+        self.assertEqual(change["entry"]["machine_ids"], ["machine-001"])
+
+        # Followers from another epoch must start again from a snapshot
+        response = self.app.get(
+            "/replication/changes?since=1&epoch=stale", auth=self.admin_auth
+        )
+        self.assertEqual(response.status_code, 410)
+        response = self.app.get("/replication/changes?since=1", auth=self.billing_auth)
+        self.assertEqual(response.status_code, 403)
+
+    def test_snapshot_and_restore(self):
+        """Test taking a snapshot online and restoring it into a new layout."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        with patch("keyserver.snapshots.SNAPSHOT_DIR", tmp_dir):
+            response = self.app.post("/snapshots", auth=self.admin_auth)
+            self.assertEqual(response.status_code, 202)
+            name = response.get_json()["snapshot"]
+            # The snapshot is written in the background while the lock is held
+            with snapshots._running:
+                response = self.app.post("/snapshots", auth=self.admin_auth)
+                self.assertEqual(response.status_code, 409)
+            response = self.app.get("/snapshots", auth=self.admin_auth)
+            self.assertEqual(response.get_json()["snapshots"], [name])
+        self.app.delete("/delete-key?key=TEST-1234-5678", auth=self.admin_auth)
+
+        keys_path = os.path.join(tmp_dir, "keys.json")
+        logs_path = os.path.join(tmp_dir, "logs.json")
+        snapshot = os.path.join(tmp_dir, name)
+        restore_snapshot(snapshot, keys_path, logs_path, shards=2)
+        store = KeyStore(keys_path, shards=2)
+        self.assertEqual([e["key"] for e in store.all()], ["TEST-1234-5678"])
+        self.assertEqual(store.warm()["source"], "index")
+        with open(logs_path) as f:
+            json.load(f)
+
+        # A tampered snapshot is rejected before anything is replaced
+        with tarfile.open(snapshot, "r:gz") as tar:
+            members = [(m, tar.extractfile(m).read()) for m in tar.getmembers()]
+        with tarfile.open(snapshot, "w:gz") as tar:
+            for member, data in members:
+                if member.name.startswith("keys/"):
+                    data = data.replace(b"TEST-1234-5678", b"TEST-0000-0000")
+                tar.addfile(member, io.BytesIO(data))
+        with self.assertRaises(ValueError):
+            restore_snapshot(snapshot, keys_path, logs_path, shards=2)
+        self.assertEqual(len(KeyStore(keys_path, shards=2).all()), 1)
+
+        # Restoring the single-file snapshot drops the shards of the old layout
+        with tarfile.open(snapshot, "w:gz") as tar:
+            for member, data in members:
+                tar.addfile(member, io.BytesIO(data))
+        restore_snapshot(snapshot, keys_path, logs_path, shards=1)
+        self.assertEqual(existing_shard_paths(keys_path), [keys_path])
+        self.assertEqual(
+            [e["key"] for e in KeyStore(keys_path).all()], ["TEST-1234-5678"]
+        )
+
+    def test_change_feed(self):
+        """Test long-polling and streaming key changes, including expiry."""
+        find_key("TEST-1234-5678")  # Load the keys written by setUp
+        since = self.app.get("/replication/status").get_json()["seq"]
+        self.app.post(
+            "/key?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.billing_auth,
+        )
+        entry = find_key("TEST-1234-5678")
+        entry["expiration_date"] = (datetime.now() - timedelta(days=1)).isoformat()
+        update_keys(entry)
+
+        response = self.app.get(f"/changes?since={since}", auth=self.admin_auth)
+        changes = response.get_json()["changes"]
+        epoch = response.get_json()["epoch"]
+        self.assertEqual([c["event"] for c in changes], ["update", "update", "expire"])
+        self.assertEqual([c["seq"] for c in changes], list(range(since + 1, since + 4)))
+
+        response = self.app.get(
+            "/changes/stream",
+            auth=self.admin_auth,
+            headers={"Last-Event-ID": f"{epoch}:{since}"},
+            buffered=False,
+        )
+        self.assertEqual(response.mimetype, "text/event-stream")
+        body = b""
+        for chunk in response.response:
+            body += chunk
+            if body.count(b"event: ") == 3:
+                break
+        response.close()
+        events = [line for line in body.decode().splitlines() if line]
+        self.assertEqual(events[0], "retry: 1000")
+        self.assertEqual(events[-3:-1], [f"id: {epoch}:{since + 3}", "event: expire"])
+
+    def test_waiting_requests_are_capped(self):
+        """Test that streams and long polls beyond MAX_EVENT_STREAMS get 503."""
+        slots = BoundedSemaphore(1)
+        with patch("keyserver.routes.event_stream_slots", slots):
+            response = self.app.get(
+                "/recent-logs/stream", auth=self.admin_auth, buffered=False
+            )
+            self.assertEqual(response.status_code, 200)
+            for path in (
+                "/recent-logs/stream",
+                "/changes/stream",
+                "/recent-logs?wait=1",
+                "/changes?since=0&wait=1",
+            ):
+                busy = self.app.get(path, auth=self.admin_auth)
+                self.assertEqual(busy.status_code, 503)
+            # Requests that do not wait are still answered
+            self.assertEqual(
+                self.app.get("/recent-logs", auth=self.admin_auth).status_code, 200
+            )
+
+            # Closing the stream frees its slot
+            response.close()
+            response = self.app.get("/recent-logs?wait=0.01", auth=self.admin_auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(slots.acquire(blocking=False))
+
+    def test_recent_logs(self):
+        """Test tailing the request log from memory."""
+        self.app.post(
+            "/key?key=TEST-1234-5678&machine_id=machine-001",
+            auth=self.billing_auth,
+        )
+        self.app.post("/key?key=UNKNOWN&machine_id=machine-001")
+
+        # Served without touching the disk
+        with patch("builtins.open", side_effect=AssertionError("disk access")):
+            response = self.app.get("/recent-logs?limit=2", auth=self.admin_auth)
+        data = response.get_json()
+        actions = [entry["action"] for entry in data["logs"]]
+        self.assertEqual(actions, ["activate_key", "invalid_key_attempt"])
+
+        response = self.app.get(
+            "/recent-logs?action=activate_key", auth=self.admin_auth
+        )
+        logs = response.get_json()["logs"]
+        self.assertTrue(logs)
+        self.assertEqual({entry["action"] for entry in logs}, {"activate_key"})
+        response = self.app.get(
+            f"/recent-logs?since={data['seq']}", auth=self.admin_auth
+        )
+        self.assertEqual(response.get_json()["logs"], [])
+
+        response = self.app.get(
+            "/recent-logs/stream",
+            auth=self.admin_auth,
+            headers={"Last-Event-ID": str(data["seq"] - 1)},
+            buffered=False,
+        )
+        body = b""
+        for chunk in response.response:
+            body += chunk
+            if b"data: " in body:
+                break
+        response.close()
+        event = json.loads(body.split(b"data: ")[1])
+        self.assertEqual(event["action"], "invalid_key_attempt")
+
+        # Paging back from the oldest entry shown
+        response = self.app.get(
+            f"/recent-logs?limit=1&before={data['logs'][1]['seq']}",
+            auth=self.admin_auth,
+        )
+        self.assertEqual(response.get_json()["logs"], data["logs"][:1])
+
+    def test_fixed_replies(self):
+        """Test the pre-encoded invalid and expired replies."""
+        response = self.app.post("/key?key=UNKNOWN&machine_id=machine-001")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(
+            response.get_json(), {"status": "invalid", "message": "The key is invalid."}
+        )
+
+        # The store drops expired keys, so hand the route one directly
+        expired = dict(
+            self.test_key,
+            expiration_date=(datetime.now() - timedelta(days=1)).isoformat(),
+        )
+        with patch("keyserver.routes.find_key", return_value=expired):
+            response = self.app.post(
+                f"/key?key={expired['key']}&machine_id=machine-001"
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["status"], "expired")
+
+    def test_search_and_bulk_edit_keys(self):
+        """Test paging through key searches and editing the keys found."""
+        response = self.app.post(
+            f"/generate-keys?count=5&machine_limit=1&product_id={self.test_product_id}",
+            auth=self.admin_auth,
+        )
+        generated = response.json["keys"]
+
+        found = []
+        cursor = 0
+        while cursor is not None:
+            response = self.app.get(
+                f"/keys/search?product_id={self.test_product_id}&limit=2"
+                f"&cursor={cursor}",
+                auth=self.admin_auth,
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json["keys"]), 2)
+            found += [entry["key"] for entry in response.json["keys"]]
+            cursor = response.json["next_cursor"]
+        self.assertEqual(sorted(found), sorted(generated + [self.test_key["key"]]))
+
+        response = self.app.get(
+            "/keys/search?key=test-1234&activated=false", auth=self.admin_auth
+        )
+        self.assertEqual(
+            [entry["key"] for entry in response.json["keys"]], [self.test_key["key"]]
+        )
+        response = self.app.get("/keys/search", auth=self.billing_auth)
+        self.assertEqual(response.status_code, 403)
+
+        with patch(
+            "keyserver.utils.append_log_entries", wraps=append_log_entries
+        ) as append:
+            response = self.app.put(
+                "/edit-keys",
+                json={"keys": generated[:3] + ["UNKNOWN"], "machine_limit": 7},
+                auth=self.admin_auth,
+            )
+        self.assertEqual(response.json["updated"], 3)
+        self.assertEqual(response.json["not_found"], ["UNKNOWN"])
+        # The edits are logged with a single append
+        self.assertEqual(append.call_count, 1)
+        self.assertEqual(
+            [entry["details"]["key"] for entry in append.call_args.args[1]],
+            generated[:3],
+        )
+        for key in generated:
+            response = self.app.get(f"/key-info?key={key}", auth=self.admin_auth)
+            expected = 7 if key in generated[:3] else 1
+            self.assertEqual(response.json["key_info"]["machine_limit"], expected)
+
+        response = self.app.put("/edit-keys", json={"keys": []}, auth=self.admin_auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "logs.json")
+        self.entries = [{"action": f"action-{i}", "details": [i]} for i in range(20)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_append_matches_full_rewrite(self):
+        """Test that in-place appends produce the same file as a full dump."""
+        for indent in (0, 2, 4):
+            with patch("keyserver.codec.JSON_INDENT", indent), patch(
+                "keyserver.streaming.JSON_INDENT", indent
+            ):
+                with open(self.path, "wb") as f:
+                    f.write(codec.dumps([]))
+                for entry in self.entries:
+                    self.assertTrue(append_log_entry(self.path, entry))
+                with open(self.path, "rb") as f:
+                    self.assertEqual(f.read(), codec.dumps(self.entries))
+                self.assertEqual(list(iter_logs(self.path)), self.entries)
+
+    def test_torn_tail_is_repaired(self):
+        """Test that an interrupted append never costs earlier entries."""
+        for torn, cut_off in (
+            (b'[{"action":"a"},{"action":"b"},{"action":', b',{"action":'),
+            (b'[\n    {"action": "a"},\n    {"action": "b"}', None),
+            (b'{"action":"a"}\n{"action":"b"}\n{"action":', b'{"action":'),
+        ):
+            with open(self.path, "wb") as f:
+                f.write(torn)
+            self.assertTrue(append_log_entry(self.path, {"action": "new"}))
+            actions = [entry["action"] for entry in iter_logs(self.path)]
+            self.assertEqual(actions, ["a", "b", "new"])
+
+            # The cut-off bytes are kept aside
+            torn_paths = [
+                os.path.join(self.tmp_dir, name)
+                for name in os.listdir(self.tmp_dir)
+                if ".torn-" in name
+            ]
+            self.assertEqual(len(torn_paths), 0 if cut_off is None else 1)
+            for torn_path in torn_paths:
+                with open(torn_path, "rb") as f:
+                    self.assertEqual(f.read(), cut_off)
+                os.remove(torn_path)
+
+        self.assertIsNone(repair_log(self.path))
+
+    def test_codecs_agree(self):
+        """Test that every available codec reads what the others write."""
+        data = {"valid_keys": self.entries, "text": "ключ ✓"}
+        for writer in codec.CODECS.values():
+            for reader in codec.CODECS.values():
+                for indent in (0, 2, 4):
+                    encoded = writer().dumps(data, indent)
+                    self.assertEqual(reader().loads(encoded), data)
+                    self.assertEqual(json.loads(encoded), data)
+        self.assertEqual(codec.StdlibCodec().dumps([1, {"a": None}]), b'[1,{"a":null}]')
+
+    def test_iterators_across_chunks(self):
+        """Test incremental parsing with entries spanning chunk boundaries."""
+        keys_path = os.path.join(self.tmp_dir, "keys.json")
+        with open(keys_path, "w") as f:
+            json.dump({"valid_keys": self.entries}, f, indent=4)
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=4)
+        with patch("keyserver.streaming.CHUNK_SIZE", 5):
+            self.assertEqual(list(iter_keys(keys_path)), self.entries)
+            self.assertEqual(list(iter_logs(self.path)), self.entries)
+
+    def test_convert_to_jsonl(self):
+        """Test converting an array log to line-delimited JSON and appending."""
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=4)
+        self.assertEqual(convert_to_jsonl(self.path, iter_logs), len(self.entries))
+        self.assertEqual(detect_format(self.path), "jsonl")
+        append_log_entry(self.path, {"action": "new"})
+        self.assertEqual(list(iter_logs(self.path)), self.entries + [{"action": "new"}])
+
+    def test_stable_view_survives_appends(self):
+        """Test that a log view taken before appends stays valid JSON."""
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=4)
+        with open(self.path, "rb") as f:
+            length, suffix = stable_view(f)
+        for entry in self.entries:
+            append_log_entry(self.path, entry)
+        with open(self.path, "rb") as f:
+            self.assertEqual(json.loads(f.read(length) + suffix), self.entries)
+
+
+class ShardedStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "keys.json")
+        self.entries = [
+            {
+                "key": f"KEY-{i}",
+                "expiration_days": 0,
+                "expiration_date": None,
+                "machine_limit": 1,
+                "machine_ids": [],
+                "product_id": "Sharded",
+                "activated": False,
+            }
+            for i in range(40)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_writes_only_touch_their_shard(self):
+        """Test that keys are spread over shards and updates rewrite one file."""
+        store = KeyStore(self.path, shards=4)
+        store.add(*self.entries)
+        paths = shard_paths(self.path, 4)
+        stamps = [os.stat(path).st_mtime_ns for path in paths]
+        self.assertTrue(all(len(list(iter_keys(path))) for path in paths))
+
+        entry = store.get("KEY-7")
+        entry["machine_ids"].append("machine-001")
+        store.update(entry)
+        changed = [os.stat(path).st_mtime_ns != old for path, old in zip(paths, stamps)]
+        self.assertEqual(changed.count(True), 1)
+
+        reloaded = KeyStore(self.path, shards=4)
+        self.assertEqual(len(reloaded.all()), len(self.entries))
+        self.assertEqual(reloaded.get("KEY-7")["machine_ids"], ["machine-001"])
+
+    def test_reshard(self):
+        """Test moving keys between shard counts and refusing a wrong count."""
+        KeyStore(self.path).add(*self.entries)
+        with self.assertRaises(RuntimeError):
+            KeyStore(self.path, shards=3).all()
+
+        self.assertEqual(reshard(self.path, 3), len(self.entries))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(len(KeyStore(self.path, shards=3).all()), len(self.entries))
+
+        self.assertEqual(reshard(self.path, 1), len(self.entries))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ["keys.json"])
+        keys = sorted(KeyStore(self.path).all(), key=lambda e: int(e["key"][4:]))
+        self.assertEqual(keys, self.entries)
+
 
 if __name__ == "__main__":
     unittest.main()